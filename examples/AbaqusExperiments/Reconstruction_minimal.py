@@ -32,7 +32,7 @@ kin_fields = recolo.kinematic_fields_from_deflections(abq_sim_fields.disp_fields
 
 # Reconstruct pressure using the virtual fields method
 virtual_field = recolo.virtual_fields.Hermite16(win_size, abq_sim_fields.pixel_size_x)
-pressure_fields = np.array([recolo.solver_VFM.calc_pressure_thin_elastic_plate(field, plate, virtual_field) for field in kin_fields])
+pressure_fields = recolo.solver_VFM.calc_pressure_thin_elastic_plate_stack(kin_fields, plate, virtual_field)
 
 # Plot the results
 # Correct pressure history used in the Abaqus simulation
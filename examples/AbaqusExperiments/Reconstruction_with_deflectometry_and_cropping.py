@@ -42,7 +42,7 @@ grid_pitch = 5.  # pixels
 
 for remove_pixel in remove_n_pixels:
     # Load Abaqus data
-    abq_sim_fields = recolo.load_abaqus_rpts(os.path.join(cwd, "AbaqusExampleData/"))
+    abq_sim_fields = recolo.load_abaqus_rpts(os.path.join(cwd, "AbaqusExampleData/"), cache=True)
     pixel_size_on_mirror = abq_sim_fields.pixel_size_x
     if remove_pixel == 0:
         cropped_disp_field = abq_sim_fields.disp_fields
@@ -53,30 +53,23 @@ disp_fields = recolo.slope_integration.disp_from_slopes(slopes_x, slopes_y, pixe
                                                         zero_at="bottom corners", zero_at_size=5,
                                                         filter_sigma=filter_space_sigma, downsample=downsampling_factor)
 
-# Results are stored in these lists
-times = []
-presses = []
-
 kin_fields = recolo.kinematic_fields_from_deflections(disp_fields, downsampling_factor * pixel_size_on_mirror, sampling_rate,
                                                       filter_time_sigma=filter_time_sigma)
 virtual_field = recolo.virtual_fields.Hermite16(win_size, downsampling_factor * pixel_size_on_mirror)
 
-for i, field in enumerate(kin_fields):
-    print("Processing frame %i" % i)
-    recon_press = recolo.solver_VFM.calc_pressure_thin_elastic_plate(field, plate, virtual_field)
-    presses.append(recon_press)
-    times.append(field.time)
-
-presses = np.array(presses)
-center = int(presses.shape[1] / 2)
+# The force acting on the whole plate and on a subsection of the plate, without calculating the pressure fields
+regions = [np.s_[:, :], np.s_[20:50, 20:50]]
+forces = recolo.solver_VFM.calc_force_thin_elastic_plate_regions(kin_fields, plate, virtual_field, regions,
+                                                                 pixel_size_on_mirror * downsampling_factor)
+times = [field.time for field in kin_fields]
 
 # Load impact hammer data
 hammer_force, hammer_time = exp_data.hammer_data()
 
 # Plot the results
 plt.figure(figsize=(7,5))
-plt.plot(1000*np.array(times), np.sum(presses, axis=(1, 2)) * ((pixel_size_on_mirror * downsampling_factor) ** 2.), label="VFM force from whole plate")
-plt.plot(1000*np.array(times), np.sum(presses[:,20:50,20:50], axis=(1, 2)) * ((pixel_size_on_mirror * downsampling_factor) ** 2.), label="VFM force from subsection of plate")
+plt.plot(1000*np.array(times), forces[:, 0], label="VFM force from whole plate")
+plt.plot(1000*np.array(times), forces[:, 1], label="VFM force from subsection of plate")
 plt.plot(1000*hammer_time, hammer_force, label="Impact hammer")
 plt.xlim(left=0.8, right=3)
 plt.ylim(top=500, bottom=-100)
@@ -1,8 +1,14 @@
 from recolo.math_tools.complex_step_diff import dF_complex_x, dF_complex_y, ddF_complex_x, ddF_complex_xy, ddF_complex_y
+from recolo.math_tools.temporal_kernels import gaussian_derivative_kernel, gaussian_temporal_kernels, \
+    temporal_derivatives, CausalTemporalFilter
 import numpy as np
-from scipy.ndimage import gaussian_filter, gaussian_filter1d
+from scipy.ndimage import gaussian_filter, gaussian_filter1d, convolve1d
 from copy import copy
-from collections import namedtuple
+from collections import namedtuple, OrderedDict, deque
+import threading
+import operator
+import json
+import os
 import logging
 
 
@@ -39,8 +45,75 @@ class FieldStack(object):
         self._curv_xx_, self._curv_yy_, self._curv_xy_ = curvatures
         self._acceleration_ = acceleration
         self._times_ = times
+        self._block_ = None
 
-        self._iter_counter_ = 0
+    @staticmethod
+    def from_block(block, times):
+        """
+        Make a FieldStack from a single contiguous block holding all fields.
+        The fields of the stack, and the Fields returned for every frame, are views into the block.
+
+        Parameters
+        ----------
+        block : ndarray
+            The fields with shape [component,frame,x,y], where the components are the deflection, slope_x,
+            slope_y, curv_xx, curv_yy, curv_xy and acceleration.
+        times : ndarray
+            The times at which the frames are sampled. Has the shape [frame]
+
+        Returns
+        -------
+        field_stack : FieldStack
+            The field stack
+        """
+        if np.ndim(block) != 4 or np.shape(block)[0] != len(_stored_field_names):
+            raise ValueError("The block has to have the shape (%i,n_frames,n_pix_x,n_pix_y)" % len(
+                _stored_field_names))
+
+        deflection, slope_x, slope_y, curv_xx, curv_yy, curv_xy, acceleration = block
+        field_stack = FieldStack(deflection, (slope_x, slope_y), (curv_xx, curv_yy, curv_xy), acceleration,
+                                 np.asarray(times))
+        field_stack._block_ = block
+        return field_stack
+
+    def block(self):
+        """
+        The contiguous block holding all fields with shape [component,frame,x,y], see FieldStack.from_block.
+
+        Returns
+        -------
+        block : ndarray, None
+            The block, or None if the fields are stored as separate arrays
+        """
+        return self._block_
+
+    def contiguous(self, dtype=np.float64, batch_size=64):
+        """
+        Copy the fields into a single contiguous block, see FieldStack.from_block.
+
+        Parameters
+        ----------
+        dtype : numpy dtype
+            The data type of the block
+        batch_size : int
+            The number of frames which are copied at once
+
+        Returns
+        -------
+        field_stack : FieldStack
+            The field stack backed by the block
+        """
+        if type(batch_size) != int or batch_size < 1:
+            raise ValueError("The batch size has to be an integer larger or equal to 1")
+
+        n_frames, n_pts_x, n_pts_y = self.shape()
+        block = np.empty((len(_stored_field_names), n_frames, n_pts_x, n_pts_y), dtype=dtype)
+        times = np.zeros(n_frames)
+        for frames, fields in self.iter_batches(batch_size):
+            for i, name in enumerate(_stored_field_names):
+                block[i, frames] = getattr(fields, name)
+            times[frames] = fields.time
+        return FieldStack.from_block(block, times)
 
     def __len__(self):
         return len(self._deflection_)
@@ -62,20 +135,521 @@ class FieldStack(object):
                       self._curv_xx_[frame_id], self._curv_yy_[frame_id], self._curv_xy_[frame_id],
                       self._acceleration_[frame_id], self._times_[frame_id])
 
+    def __getitem__(self, key):
+        """
+        Get the kinematic fields for a given time frame, or a new FieldStack for a range of time frames and a
+        region of interest. The new FieldStack is backed by views of the fields of this stack, such that no
+        fields are copied.
+
+        Parameters
+        ----------
+        key : int, slice, tuple
+            The frame id or a slice of frames, optionally followed by slices along the x-axis and the y-axis,
+            e.g. stack[100:200, 10:50, 10:50]
+        Returns
+        -------
+        fields : Fields, FieldStack
+            The kinematic fields for a single time frame if a frame id is given, else a FieldStack
+        """
+        time_key, roi = _split_stack_key(key)
+        if isinstance(time_key, slice):
+            return self._view(time_key, roi)
+
+        frame_id = range(len(self))[time_key]
+        return self._view(slice(frame_id, frame_id + 1), roi)(0)
+
+    def _view(self, time_key, roi):
+        key = (time_key,) + roi
+        if self._block_ is not None:
+            return FieldStack.from_block(self._block_[(slice(None),) + key], np.asarray(self._times_)[time_key])
+        return FieldStack(self._deflection_[key], (self._slope_x_[key], self._slope_y_[key]),
+                          (self._curv_xx_[key], self._curv_yy_[key], self._curv_xy_[key]), self._acceleration_[key],
+                          np.asarray(self._times_)[time_key])
+
     def __iter__(self):
-        return copy(self)
+        # Every call gives an independent iterator over the frames
+        return (self(frame_id) for frame_id in range(len(self)))
 
-    def __next__(self):
-        num = self._iter_counter_
-        self._iter_counter_ += 1
-        if self._iter_counter_ > self.__len__():
-            raise StopIteration
-        else:
-            return self.__call__(num)
+    def iter_batches(self, batch_size):
+        """
+        Iterate over the stack in batches of consecutive frames.
+
+        The returned iterator is thread-safe, such that several worker threads can pull batches from the same
+        iterator, each getting a disjoint range of frames. The fields of a batch are views of the fields of the
+        stack where possible.
+
+        Parameters
+        ----------
+        batch_size : int
+            The number of frames in every batch, except possibly the last batch
+
+        Returns
+        -------
+        batches : FrameBatchIterator
+            Iterator yielding FieldBatch(frames, fields), where frames is the slice of frames in the batch and
+            fields are the kinematic fields of these frames stacked along the first axis
+        """
+        return FrameBatchIterator(self, batch_size)
 
     def shape(self):
         return np.shape(self._deflection_)
 
+    def save(self, path, batch_size=64):
+        """
+        Save the kinematic fields to a directory, which is created if it does not exist.
+
+        The directory contains:
+            * One .npy file per field, named deflection.npy, slope_x.npy, slope_y.npy, curv_xx.npy,
+              curv_yy.npy, curv_xy.npy and acceleration.npy, each with shape (n_frames, n_pts_x, n_pts_y)
+            * times.npy with shape (n_frames)
+            * metadata.json with the format name, the format version, the shape of the stack and the names of
+              the fields
+
+        The fields are written in batches of frames directly into the files, such that lazy stacks are saved
+        without holding all fields in memory.
+
+        Parameters
+        ----------
+        path : str
+            The path to the directory
+        batch_size : int
+            The number of frames which are written at once
+        """
+        logger = logging.getLogger(__name__)
+        if type(batch_size) != int or batch_size < 1:
+            raise ValueError("The batch size has to be an integer larger or equal to 1")
+
+        os.makedirs(path, exist_ok=True)
+        n_frames, n_pts_x, n_pts_y = self.shape()
+        field_names = _stored_field_names
+        files = [np.lib.format.open_memmap(os.path.join(path, name + ".npy"), mode="w+", dtype=np.float64,
+                                           shape=(n_frames, n_pts_x, n_pts_y)) for name in field_names]
+        times = np.zeros(n_frames)
+
+        for frames, fields in self.iter_batches(batch_size):
+            logger.info("Saving frame %i to %i" % (frames.start, frames.stop - 1))
+            for file, name in zip(files, field_names):
+                file[frames] = getattr(fields, name)
+            times[frames] = fields.time
+
+        for file in files:
+            file.flush()
+        del files
+        np.save(os.path.join(path, "times.npy"), times)
+
+        metadata = {"format": _stack_format, "version": _stack_format_version, "shape": [n_frames, n_pts_x, n_pts_y],
+                    "fields": list(field_names)}
+        with open(os.path.join(path, "metadata.json"), "w") as file:
+            json.dump(metadata, file, indent=2)
+
+    @staticmethod
+    def load(path, mmap=True):
+        """
+        Load kinematic fields saved by FieldStack.save.
+
+        Parameters
+        ----------
+        path : str
+            The path to the directory
+        mmap : bool
+            Memory map the fields as read-only arrays, such that the frames are read from disk when they are
+            accessed. If False, all fields are read into memory.
+
+        Returns
+        -------
+        field_stack : FieldStack
+            The kinematic fields
+        """
+        with open(os.path.join(path, "metadata.json"), "r") as file:
+            metadata = json.load(file)
+
+        if metadata.get("format") != _stack_format or metadata.get("version") != _stack_format_version:
+            raise ValueError("The directory does not contain a field stack of a supported format")
+
+        mmap_mode = "r" if mmap else None
+        fields = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode) for name in
+                  metadata["fields"]}
+        times = np.load(os.path.join(path, "times.npy"))
+
+        for name, field in fields.items():
+            if list(np.shape(field)) != metadata["shape"]:
+                raise ValueError("The %s fields do not have the shape given in the metadata" % name)
+
+        return FieldStack(fields["deflection"], (fields["slope_x"], fields["slope_y"]),
+                          (fields["curv_xx"], fields["curv_yy"], fields["curv_xy"]), fields["acceleration"], times)
+
+
+FieldBatch = namedtuple("FieldBatch", ["frames", "fields"])
+
+
+class FrameBatchIterator(object):
+    def __init__(self, field_stack, batch_size):
+        """
+        Thread-safe iterator over a FieldStack in batches of consecutive frames, see FieldStack.iter_batches.
+        Only claiming the next range of frames is done while holding a lock, such that the fields of several
+        batches can be gathered concurrently.
+
+        Parameters
+        ----------
+        field_stack : FieldStack
+            The kinematic fields
+        batch_size : int
+            The number of frames in every batch
+        """
+        if type(batch_size) != int or batch_size < 1:
+            raise ValueError("The batch size has to be an integer larger or equal to 1")
+
+        self._field_stack_ = field_stack
+        self._batch_size_ = batch_size
+        self._n_frames_ = len(field_stack)
+        self._next_start_ = 0
+        self._lock_ = threading.Lock()
+
+    def __len__(self):
+        return int(np.ceil(self._n_frames_ / float(self._batch_size_)))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock_:
+            start = self._next_start_
+            if start >= self._n_frames_:
+                raise StopIteration
+            stop = min(start + self._batch_size_, self._n_frames_)
+            self._next_start_ = stop
+
+        frames = slice(start, stop)
+        return FieldBatch(frames, self._field_stack_(frames))
+
+
+_stack_format = "recolo.FieldStack"
+_stack_format_version = 1
+_stored_field_names = ("deflection", "slope_x", "slope_y", "curv_xx", "curv_yy", "curv_xy", "acceleration")
+
+
+def _split_stack_key(key):
+    """
+    Split the key of FieldStack.__getitem__ into a frame id or a slice of frames, and a region of interest
+    given as slices along the x-axis and the y-axis.
+    """
+    key = key if isinstance(key, tuple) else (key,)
+    if len(key) > 3:
+        raise IndexError("A FieldStack can only be indexed along the time, x and y axis")
+    key = key + (slice(None),) * (3 - len(key))
+    time_key, roi = key[0], key[1:]
+
+    if not isinstance(time_key, slice):
+        try:
+            time_key = operator.index(time_key)
+        except TypeError:
+            raise IndexError("The frames have to be given as an integer or a slice")
+
+    for sub_key in key:
+        if isinstance(sub_key, slice) and sub_key.step is not None and sub_key.step < 1:
+            raise IndexError("Only positive steps are supported")
+    if not all(isinstance(sub_key, slice) for sub_key in roi):
+        raise IndexError("The region of interest has to be given as slices")
+    return time_key, roi
+
+
+class LazyFieldStack(FieldStack):
+    def __init__(self, deflection, acceleration, times, plate_len_x, plate_len_y, cache_size=0):
+        """
+        Stack of kinematic fields where only the deflection fields, and optionally the acceleration fields, are
+        stored. The slopes, curvatures and accelerations are calculated when a frame is requested, giving the
+        same fields as fieldStack_from_disp_fields while only keeping the deflection fields in memory.
+
+        When the acceleration fields are not given, they are determined from the deflection of the two neighbouring
+        frames on either side of the requested frame.
+
+        Parameters
+        ----------
+        deflection : ndarray
+            The deflection fields with shape [frame,x,y]
+        acceleration : ndarray, None
+            The acceleration fields with shape [frame,x,y].
+            If "None", the accelerations are calculated from the deflections.
+        times : ndarray
+            The times at which the frames are sampled. Has the shape [frame]
+        plate_len_x : float
+            The plate length along the x-axis
+        plate_len_y : float
+            The plate length along the y-axis
+        cache_size : int
+            The maximum number of frames which are kept in memory after being calculated.
+            The least recently used frames are evicted when the cache is full.
+        """
+        if np.ndim(deflection) != 3:
+            raise ValueError("The deflection fields have to have the shape (n_frames,n_pix_x,n_pix_y)")
+
+        if acceleration is None and len(deflection) < 2:
+            raise ValueError("At least two frames are needed to determine the accelerations")
+
+        if acceleration is not None and np.shape(acceleration) != np.shape(deflection):
+            raise ValueError("The acceleration fields have to have the same shape as the deflection fields")
+
+        if type(cache_size) != int or cache_size < 0:
+            raise ValueError("The cache size has to be an integer larger or equal to 0")
+
+        self._deflection_ = deflection
+        self._acceleration_ = acceleration
+        self._times_ = np.array(times)
+        n_pts_x, n_pts_y = np.shape(deflection)[1:]
+        self._pixel_size_x_ = plate_len_x / n_pts_x
+        self._pixel_size_y_ = plate_len_y / n_pts_y
+
+        self._block_ = None
+        self._cache_size_ = cache_size
+        self._cache_ = OrderedDict()
+        self._lock_ = threading.Lock()
+
+        # The frames and the region of interest of the deflection fields which are covered by this stack
+        self._frames_ = range(len(deflection))
+        self._roi_ = (range(n_pts_x), range(n_pts_y))
+
+    def __len__(self):
+        return len(self._frames_)
+
+    def shape(self):
+        return (len(self._frames_),) + tuple(len(roi) for roi in self._roi_)
+
+    def _view(self, time_key, roi):
+        view = copy(self)
+        view._frames_ = self._frames_[time_key]
+        view._roi_ = tuple(current_roi[sub_key] for current_roi, sub_key in zip(self._roi_, roi))
+        view._cache_ = OrderedDict()
+        view._lock_ = threading.Lock()
+        return view
+
+    def _roi_slices(self, halo=0):
+        """
+        Slices of the region of interest extended by a halo of pixels, and the slices which crop the region of
+        interest from the extended region.
+        """
+        roi_slices, crop_slices = [], []
+        for roi, n_pts in zip(self._roi_, np.shape(self._deflection_)[1:]):
+            if len(roi) == 0:
+                roi_slices.append(slice(0, 0))
+                crop_slices.append(slice(0, 0))
+                continue
+            start = max(roi[0] - halo, 0)
+            stop = min(roi[-1] + 1 + halo, n_pts)
+            roi_slices.append(slice(start, stop))
+            crop_slices.append(slice(roi[0] - start, roi[-1] + 1 - start, roi.step))
+        return tuple(roi_slices), tuple(crop_slices)
+
+    def _frame_acceleration(self, frame_id, roi):
+        # The double central difference of a frame only depends on the two neighbouring frames on either side,
+        # including the one-sided differences at the ends of the stack
+        n_frames = len(self._deflection_)
+        start = max(frame_id - 2, 0)
+        stop = min(frame_id + 3, n_frames)
+        time_step_size = float(self._times_[1]) - float(self._times_[0])
+        return _acceleration_from_disp_fields(self._deflection_[(slice(start, stop),) + roi], time_step_size)[
+            frame_id - start]
+
+    def _frame(self, frame_id):
+        with self._lock_:
+            if frame_id in self._cache_:
+                self._cache_.move_to_end(frame_id)
+                return self._cache_[frame_id]
+
+        stack_frame_id = self._frames_[frame_id]
+        roi = tuple(slice(sub_roi.start, sub_roi.stop, sub_roi.step) for sub_roi in self._roi_)
+
+        # The curvatures depend on the deflection of the two neighbouring pixels, such that the region of
+        # interest is extended by a halo of two pixels to get the same fields as for the whole frame
+        halo_roi, crop = self._roi_slices(halo=2)
+        disp_field = self._deflection_[stack_frame_id][halo_roi]
+        slope_x, slope_y, curv_xx, curv_yy, curv_xy = [field[crop] for field in _kinematics_from_disp_fields(
+            disp_field, self._pixel_size_x_, self._pixel_size_y_)]
+
+        if self._acceleration_ is None:
+            acceleration = self._frame_acceleration(stack_frame_id, roi)
+        else:
+            acceleration = self._acceleration_[stack_frame_id][roi]
+
+        fields = Fields(self._deflection_[stack_frame_id][roi], slope_x, slope_y, curv_xx, curv_yy, curv_xy,
+                        acceleration, self._times_[stack_frame_id])
+
+        if self._cache_size_ > 0:
+            with self._lock_:
+                self._cache_[frame_id] = fields
+                while len(self._cache_) > self._cache_size_:
+                    self._cache_.popitem(last=False)
+        return fields
+
+    def __call__(self, frame_id, *args, **kwargs):
+        """
+        Get kinematic fields for a given time frame, or a range of time frames.
+
+        Parameters
+        ----------
+        frame_id : int, slice
+            The frame id or a slice of frame ids
+        Returns
+        -------
+        fields : Fields
+            The kinematic fields for a single time frame, or the fields stacked along the first axis for a
+            range of frames
+        """
+        n_frames = len(self)
+        if isinstance(frame_id, slice):
+            frames = [self._frame(i) for i in range(*frame_id.indices(n_frames))]
+            return Fields(*[np.array(field) for field in zip(*frames)])
+
+        frame_id = int(frame_id)
+        if frame_id < -n_frames or frame_id >= n_frames:
+            raise IndexError("Frame %i is out of range for a stack of %i frames" % (frame_id, n_frames))
+        return self._frame(frame_id % n_frames)
+
+    def clear_cache(self):
+        """
+        Remove all frames from the frame cache.
+        """
+        with self._lock_:
+            self._cache_.clear()
+
+
+class StreamingFieldStack(object):
+    # The number of frames needed by the temporal stencil of the accelerations
+    _stencil_size = 5
+
+    def __init__(self, pixel_size, sampling_rate, filter_space_sigma=None, filter_time_sigma=None):
+        """
+        Stack of kinematic fields which is built incrementally from deflection fields as they are acquired.
+        The deflection fields are given frame by frame using append, and the kinematic fields of a frame are
+        returned as soon as the deflection fields needed by the acceleration stencil are available, which is two
+        frames later. The fields are the same as those given by kinematic_fields_from_deflections for the whole
+        recording.
+
+        Only the deflection fields within the temporal stencil are kept in a ring buffer, such that the memory
+        usage does not depend on the length of the recording.
+
+        Parameters
+        ----------
+        pixel_size : float
+            The physical pixel size
+        sampling_rate : float
+            The sampling rate at which the fields are acquired
+        filter_space_sigma : float
+            The standard deviation of the gaussian low-pass filter used to filter the deflection fields
+            spatially prior to differentiation.
+        filter_time_sigma : float
+            The standard deviation of the causal low-pass filter used to filter the deflection fields temporally
+            prior to differentiation, see CausalTemporalFilter. The fields are the same as those given by
+            kinematic_fields_from_deflections with temporal_filter="causal".
+        """
+        if sampling_rate <= 0:
+            raise ValueError("The sampling rate has to be larger than zero")
+
+        self._pixel_size_ = pixel_size
+        self._sampling_rate_ = sampling_rate
+        self._filter_space_sigma_ = filter_space_sigma
+        self._time_filter_ = CausalTemporalFilter(filter_time_sigma) if filter_time_sigma else None
+        self._buffer_ = deque(maxlen=self._stencil_size)
+        self._field_shape_ = None
+        self._n_appended_ = 0
+        self._n_emitted_ = 0
+        self._closed_ = False
+
+    def __len__(self):
+        """
+        The number of frames which have been appended to the stack.
+        """
+        return self._n_appended_
+
+    def _time(self, frame_id):
+        return float(frame_id) * 1. / self._sampling_rate_
+
+    def _emit(self, stop):
+        """
+        Calculate the kinematic fields for the frames up to stop, which all have to be in the buffer.
+        """
+        disp_fields = np.array(self._buffer_)
+        buffer_start = self._n_appended_ - len(disp_fields)
+        n_pts_x, n_pts_y = self._field_shape_
+        # The pixel sizes are determined as for kinematic_fields_from_deflections, giving the same rounding
+        pixel_size_x = n_pts_x * self._pixel_size_ / n_pts_x
+        pixel_size_y = n_pts_y * self._pixel_size_ / n_pts_y
+        time_step_size = self._time(1) - self._time(0)
+        accel_fields = _acceleration_from_disp_fields(disp_fields, time_step_size)
+
+        emitted = []
+        for frame_id in range(self._n_emitted_, stop):
+            disp_field = disp_fields[frame_id - buffer_start]
+            slope_x, slope_y, curv_xx, curv_yy, curv_xy = _kinematics_from_disp_fields(disp_field, pixel_size_x,
+                                                                                      pixel_size_y)
+            emitted.append(Fields(disp_field, slope_x, slope_y, curv_xx, curv_yy, curv_xy,
+                                  accel_fields[frame_id - buffer_start], self._time(frame_id)))
+        self._n_emitted_ = stop
+        return emitted
+
+    def append(self, defl_field):
+        """
+        Append the deflection field of the next frame to the stack.
+
+        Parameters
+        ----------
+        defl_field : ndarray
+            The deflection field with shape [x,y]
+
+        Returns
+        -------
+        fields : list
+            The kinematic fields of the frames which were completed by this frame, as Fields objects in order
+            of time. The list is empty while the acceleration stencil of the next frame is incomplete.
+        """
+        if self._closed_:
+            raise ValueError("Frames cannot be appended to a closed stack")
+
+        if np.ndim(defl_field) != 2:
+            raise ValueError("The deflection field has to have the shape (n_pix_x,n_pix_y)")
+
+        disp_field = np.array(defl_field, dtype=float)
+        if self._time_filter_ is not None:
+            # The filter keeps the state of the previous frames, and rejects frames of another shape
+            disp_field = self._time_filter_(disp_field[np.newaxis])[0]
+        if self._filter_space_sigma_:
+            disp_field = gaussian_filter(disp_field, sigma=self._filter_space_sigma_)
+            remove_n_invalid = int(4 * self._filter_space_sigma_ + 0.5)
+            disp_field = disp_field[remove_n_invalid:-remove_n_invalid, remove_n_invalid:-remove_n_invalid]
+
+        if self._field_shape_ is None:
+            self._field_shape_ = disp_field.shape
+        elif disp_field.shape != self._field_shape_:
+            raise ValueError("The deflection fields have to have the same shape as the first frame")
+
+        self._buffer_.append(disp_field)
+        self._n_appended_ += 1
+
+        # The one-sided stencils of the first frames are only used for recordings of at least four frames,
+        # after which a frame is completed when the deflection two frames later is available.
+        if self._n_appended_ < 4:
+            return []
+        return self._emit(self._n_appended_ - 2)
+
+    def close(self):
+        """
+        Mark the end of the recording, completing the remaining frames using the one-sided stencils.
+
+        Returns
+        -------
+        fields : list
+            The kinematic fields of the remaining frames, as Fields objects in order of time.
+        """
+        if self._closed_:
+            return []
+
+        if self._n_appended_ < 2:
+            raise ValueError("At least two frames are needed to determine the accelerations")
+
+        self._closed_ = True
+        emitted = self._emit(self._n_appended_)
+        self._buffer_.clear()
+        return emitted
+
 
 Fields = namedtuple("Fields",
                     ["deflection", "slope_x", "slope_y", "curv_xx", "curv_yy", "curv_xy", "acceleration", "time"])
@@ -83,7 +657,9 @@ Fields = namedtuple("Fields",
 
 def kinematic_fields_from_deflections(defl_fields, pixel_size, sampling_rate, acceleration_field=None,
                                       filter_space_sigma=None,
-                                      filter_time_sigma=None):
+                                      filter_time_sigma=None, lazy=False, cache_size=0,
+                                      spatial_differentiation="central", temporal_differentiation="central",
+                                      dtype=None, temporal_filter="gaussian"):
     """
     Calculate kinematic fields from a series of deflection fields.
     The following fields are calculated are:
@@ -109,39 +685,165 @@ def kinematic_fields_from_deflections(defl_fields, pixel_size, sampling_rate, ac
     filter_time_sigma : float
         The standard deviation of the gaussian low-pass filter used to filter the deflection fields
         temporally prior to differentiation.
+    lazy : bool
+        Return a LazyFieldStack which only stores the deflection fields and calculates the other fields
+        when a frame is requested.
+    cache_size : int
+        The number of frames kept in the frame cache of the LazyFieldStack
+    spatial_differentiation : str
+        The method used to determine the slopes and curvatures, either:
+            * "central": Central differences of the filtered deflection fields
+            * "gaussian": Convolution of the deflection fields with the first and second derivatives of the
+              gaussian low-pass filter, such that filtering and differentiation is done in a single pass over the
+              stack for every field. Requires filter_space_sigma to be given.
+    temporal_differentiation : str
+        The method used to determine the accelerations, either:
+            * "central": Central differences of the filtered deflection fields
+            * "gaussian": Convolution of the deflection fields with the gaussian low-pass filter and its second
+              derivative along the time axis, giving the filtered deflections and the accelerations in a single
+              pass over the stack. Requires filter_time_sigma to be given.
+    dtype : numpy dtype, None
+        If given, the fields are stored in a single contiguous block of this data type, see FieldStack.from_block
+    temporal_filter : str
+        The low-pass filter used to filter the deflection fields temporally prior to central differentiation,
+        either:
+            * "gaussian": A gaussian filter, which depends on both past and future frames
+            * "causal": A cascade of exponential moving averages, which only depends on the past frames, giving
+              the same fields as a StreamingFieldStack. See CausalTemporalFilter.
     Returns
     -------
     fieldstack : FieldStack
         The kinematic fields
     """
     logger = logging.getLogger(__name__)
+    if spatial_differentiation not in ("central", "gaussian"):
+        raise ValueError("The spatial differentiation has to be either \"central\" or \"gaussian\"")
+
+    if temporal_differentiation not in ("central", "gaussian"):
+        raise ValueError("The temporal differentiation has to be either \"central\" or \"gaussian\"")
+
+    if temporal_differentiation == "gaussian" and not filter_time_sigma:
+        raise ValueError("Gaussian differentiation in time requires the temporal filter sigma to be given")
+
+    if temporal_filter not in ("gaussian", "causal"):
+        raise ValueError("The temporal filter has to be either \"gaussian\" or \"causal\"")
+
+    if temporal_filter == "causal" and temporal_differentiation == "gaussian":
+        raise ValueError("Gaussian differentiation in time cannot be combined with the causal temporal filter")
+
+    if acceleration_field is not None:
+        logger.info("Acceleration fields were given by the user and does not correspond to filtered displacements")
+
+    if spatial_differentiation == "gaussian":
+        if not filter_space_sigma:
+            raise ValueError("Gaussian differentiation requires the spatial filter sigma to be given")
+        if lazy:
+            raise ValueError("Gaussian differentiation is not supported for lazy field stacks")
+        field_stack = _fieldStack_from_gaussian_derivatives(defl_fields, pixel_size, sampling_rate,
+                                                            acceleration_field, filter_space_sigma,
+                                                            filter_time_sigma, temporal_differentiation,
+                                                            temporal_filter)
+        return field_stack if dtype is None else field_stack.contiguous(dtype)
+
+    if lazy and dtype is not None:
+        raise ValueError("Lazy field stacks do not store the fields in a contiguous block")
+
     # Copy to make in-place operations safe
     disp_fields = copy(defl_fields)
 
-    if filter_time_sigma:
-        logger.info("Filtering in time with sigma=%f" % float(filter_time_sigma))
-        disp_fields = gaussian_filter1d(disp_fields, sigma=filter_time_sigma, axis=0, mode="nearest")
+    if filter_time_sigma and temporal_differentiation == "central":
+        disp_fields = _filter_in_time(disp_fields, filter_time_sigma, temporal_filter)
 
     if filter_space_sigma:
-        filtered_disp_fields = []
-        for i in range(len(disp_fields)):
-            logger.info(
-                "Filtering frame %i with a gussian filter with a standard deviation of %f" % (i, filter_space_sigma))
-            filtered_disp_field = gaussian_filter(disp_fields[i, :, :], sigma=filter_space_sigma)
-            remove_n_invalid = int(4 * filter_space_sigma + 0.5)
-            filtered_disp_fields.append(filtered_disp_field[remove_n_invalid:-remove_n_invalid,remove_n_invalid:-remove_n_invalid])
-        disp_fields = np.array(filtered_disp_fields)
+        logger.info("Filtering in space with a gaussian filter with a standard deviation of %f" % filter_space_sigma)
+        # All frames are filtered at once, with no filtering along the time axis
+        filtered_disp_fields = gaussian_filter(disp_fields, sigma=(0., filter_space_sigma, filter_space_sigma))
+        remove_n_invalid = int(4 * filter_space_sigma + 0.5)
+        disp_fields = filtered_disp_fields[:, remove_n_invalid:-remove_n_invalid, remove_n_invalid:-remove_n_invalid]
+
+    if temporal_differentiation == "gaussian":
+        disp_fields, accel_fields = _gaussian_time_derivatives(disp_fields, filter_time_sigma, sampling_rate)
+        if acceleration_field is None:
+            acceleration_field = accel_fields
+
     n_times, n_pts_x, n_pts_y = disp_fields.shape
 
     times = np.arange(n_times) * 1. / sampling_rate
     field_len_x = n_pts_x * pixel_size
     field_len_y = n_pts_y * pixel_size
 
+    if lazy:
+        return LazyFieldStack(disp_fields, acceleration_field, times, field_len_x, field_len_y, cache_size)
+
     if acceleration_field is not None:
-        logger.info("Acceleration fields were given by the user and does not correspond to filtered displacements")
-        return fieldStack_from_disp_fields(disp_fields, acceleration_field, times, field_len_x, field_len_y)
+        return fieldStack_from_disp_fields(disp_fields, acceleration_field, times, field_len_x, field_len_y, dtype)
     else:
-        return fieldStack_from_disp_fields(disp_fields, None, times, field_len_x, field_len_y)
+        return fieldStack_from_disp_fields(disp_fields, None, times, field_len_x, field_len_y, dtype)
+
+
+def _filter_in_time(disp_fields, filter_time_sigma, temporal_filter):
+    logger = logging.getLogger(__name__)
+    if temporal_filter == "causal":
+        logger.info("Filtering in time with a causal filter with sigma=%f" % float(filter_time_sigma))
+        return CausalTemporalFilter(filter_time_sigma)(disp_fields)
+    logger.info("Filtering in time with sigma=%f" % float(filter_time_sigma))
+    return gaussian_filter1d(disp_fields, sigma=filter_time_sigma, axis=0, mode="nearest")
+
+
+def _gaussian_time_derivatives(disp_fields, filter_time_sigma, sampling_rate):
+    """
+    Filter the deflection fields in time and determine the accelerations in a single pass over the stack.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info("Filtering and differentiating in time using gaussian derivatives with sigma=%f" % float(
+        filter_time_sigma))
+    smooth_kernel, _, accel_kernel = gaussian_temporal_kernels(filter_time_sigma, 1. / sampling_rate)
+    return temporal_derivatives(disp_fields, (smooth_kernel, accel_kernel))
+
+
+def _fieldStack_from_gaussian_derivatives(defl_fields, pixel_size, sampling_rate, acceleration_field,
+                                          filter_space_sigma, filter_time_sigma, temporal_differentiation,
+                                          temporal_filter):
+    """
+    Calculate the kinematic fields by convolving the deflection fields with gaussian derivative kernels.
+    The temporal filtering is done as in kinematic_fields_from_deflections.
+    """
+    logger = logging.getLogger(__name__)
+    accel_fields = None
+    if temporal_differentiation == "gaussian":
+        defl_fields, accel_fields = _gaussian_time_derivatives(defl_fields, filter_time_sigma, sampling_rate)
+    elif filter_time_sigma:
+        defl_fields = _filter_in_time(defl_fields, filter_time_sigma, temporal_filter)
+
+    logger.info("Calculating slopes and curvatures using gaussian derivatives with sigma=%f" % float(
+        filter_space_sigma))
+    kernels = [gaussian_derivative_kernel(filter_space_sigma, order) for order in range(3)]
+    remove_n_invalid = int(4 * filter_space_sigma + 0.5)
+    valid = np.s_[:, remove_n_invalid:-remove_n_invalid, remove_n_invalid:-remove_n_invalid]
+
+    def derivative(order_x, order_y, sign=-1., fields=defl_fields):
+        filtered = convolve1d(fields, kernels[order_x], axis=1, mode="reflect")
+        filtered = convolve1d(filtered, kernels[order_y], axis=2, mode="reflect")
+        # Cropping and scaling in a single operation to avoid an intermediate copy
+        return filtered[valid] * (sign / pixel_size ** (order_x + order_y))
+
+    deflection = derivative(0, 0, sign=1.)
+    slope_x = derivative(1, 0)
+    slope_y = derivative(0, 1)
+    curv_xx = derivative(2, 0)
+    curv_yy = derivative(0, 2)
+    curv_xy = derivative(1, 1)
+
+    times = np.arange(len(deflection)) * 1. / sampling_rate
+
+    if acceleration_field is not None:
+        acceleration = np.array(acceleration_field)
+    elif accel_fields is not None:
+        acceleration = derivative(0, 0, sign=1., fields=accel_fields)
+    else:
+        acceleration = _acceleration_from_disp_fields(deflection, 1. / sampling_rate)
+
+    return FieldStack(deflection, (slope_x, slope_y), (curv_xx, curv_yy, curv_xy), acceleration, times)
 
 
 def fieldStack_from_disp_func(disp_func, npts_x, npts_y, plate_len_x, plate_len_y):
@@ -192,14 +894,99 @@ def fieldStack_from_disp_func(disp_func, npts_x, npts_y, plate_len_x, plate_len_
     return FieldStack(deflection, (slope_x, slope_y), (curv_xx, curv_yy, curv_xy), np.zeros_like(deflection), [0])
 
 
-def fieldStack_from_disp_fields(disp_fields, acceleration_fields, times, plate_len_x, plate_len_y):
+def _central_difference(fields, spacing, axis, out):
+    """
+    Differentiate fields along an axis by central differences, using one-sided differences at the edges.
+    The results are equal to those of np.gradient(fields, spacing, axis=axis), but are written into the
+    preallocated array out.
+    """
+    fields = np.moveaxis(fields, axis, 0)
+    diff = np.moveaxis(out, axis, 0)
+    np.subtract(fields[2:], fields[:-2], out=diff[1:-1])
+    np.divide(diff[1:-1], 2. * spacing, out=diff[1:-1])
+    np.subtract(fields[1], fields[0], out=diff[0])
+    np.divide(diff[0], spacing, out=diff[0])
+    np.subtract(fields[-1], fields[-2], out=diff[-1])
+    np.divide(diff[-1], spacing, out=diff[-1])
+    return out
+
+
+def _float_dtype(fields):
+    """
+    The floating point data type of the fields, where integer fields are promoted to float64.
+    """
+    return np.result_type(fields, np.float32)
+
+
+def _kinematics_from_disp_fields(disp_fields, pixel_size_x, pixel_size_y):
+    """
+    Calculate the slopes and curvatures of a deflection field, or a stack of deflection fields with shape
+    (n_frames,x,y), by central differences over the two last axes.
+    The fields keep the floating point data type of the deflection fields.
+
+    Returns
+    -------
+    kinematics : tuple
+        The fields slope_x, slope_y, curv_xx, curv_yy and curv_xy
+    """
+    axis_x, axis_y = np.ndim(disp_fields) - 2, np.ndim(disp_fields) - 1
+    dtype = _float_dtype(disp_fields)
+    slope_x, slope_y, curv_xx, curv_yy, curv_xy = [np.empty(np.shape(disp_fields), dtype=dtype) for _ in range(5)]
+
+    # calculate slopes
+    np.negative(_central_difference(disp_fields, pixel_size_x, axis_x, slope_x), out=slope_x)
+    np.negative(_central_difference(disp_fields, pixel_size_y, axis_y, slope_y), out=slope_y)
+
+    # calculate curvatures
+    _central_difference(slope_x, pixel_size_x, axis_x, curv_xx)
+    _central_difference(slope_y, pixel_size_y, axis_y, curv_yy)
+    aux_k_s12 = _central_difference(slope_x, pixel_size_y, axis_y, curv_xy)
+    aux_k_s21 = _central_difference(slope_y, pixel_size_x, axis_x, np.empty(np.shape(disp_fields), dtype=dtype))
+    np.add(aux_k_s12, aux_k_s21, out=curv_xy)
+    np.multiply(curv_xy, .5, out=curv_xy)
+    return slope_x, slope_y, curv_xx, curv_yy, curv_xy
+
+
+def _acceleration_from_disp_fields(disp_fields, time_step_size):
+    """
+    Calculate the acceleration fields from a stack of deflection fields with shape (n_frames,x,y).
+    The results are equal to differentiating twice in time by np.gradient, but are determined by a single
+    second order stencil:
+        acc[i] = (defl[i+2] - 2 defl[i] + defl[i-2]) / (4 dt^2)
+    with the corresponding one-sided stencils for the two first and two last frames.
+    The fields keep the floating point data type of the deflection fields.
+    """
+    n_frames = len(disp_fields)
+    if n_frames < 4:
+        vel_fields = np.gradient(disp_fields, axis=0) / time_step_size
+        return np.gradient(vel_fields, axis=0) / time_step_size
+
+    accel_fields = np.empty(np.shape(disp_fields), dtype=_float_dtype(disp_fields))
+
+    np.add(disp_fields[4:], disp_fields[:-4], out=accel_fields[2:-2])
+    accel_fields[2:-2] -= disp_fields[2:-2]
+    accel_fields[2:-2] -= disp_fields[2:-2]
+
+    # Second differences of the one-sided first differences at the ends of the stack
+    for edge, step in [(0, 1), (n_frames - 1, -1)]:
+        defl_0, defl_1, defl_2, defl_3 = [disp_fields[edge + i * step] for i in range(4)]
+        accel_fields[edge] = 2. * (defl_0 - 2. * defl_1 + defl_2)
+        accel_fields[edge + step] = defl_3 - 3. * defl_1 + 2. * defl_0
+
+    accel_fields /= 4. * time_step_size ** 2.
+    return accel_fields
+
+
+def fieldStack_from_disp_fields(disp_fields, acceleration_fields, times, plate_len_x, plate_len_y, dtype=None,
+                                batch_size=64):
     """
     Make a FielsStack object from deflection fields.
 
     Parameters
     ----------
     disp_fields : ndarray
-        The deflection fields with shape (n_frames,x,y)
+        The deflection fields with shape (n_frames,x,y).
+        Floating point fields keep their data type, while integer fields are converted to float64.
     acceleration_fields : ndarray, None
         The acceleration fields with shape (n_frames,x,y).
         If "None", the accelerations are calculated from the displacements.
@@ -209,6 +996,11 @@ def fieldStack_from_disp_fields(disp_fields, acceleration_fields, times, plate_l
         The plate length along the x-axis
     plate_len_y : float
         The plate length along the y-axis
+    dtype : numpy dtype, None
+        If given, the fields are stored in a single contiguous block of this data type, see FieldStack.from_block.
+        The block is filled in batches of frames, such that no other full size fields are allocated.
+    batch_size : int
+        The number of frames which are processed at once when filling the block
 
     Returns
     -------
@@ -216,54 +1008,61 @@ def fieldStack_from_disp_fields(disp_fields, acceleration_fields, times, plate_l
         The field stack
     """
 
-    n_frames = disp_fields.shape[0]
-    deflection = []
-
-    slopes_x = []
-    slopes_y = []
-    curv_xx = []
-    curv_yy = []
-    curv_xy = []
-
-    for i in range(n_frames):
-        disp_field = disp_fields[i]
-        npts_x, npts_y = disp_field.shape
-        pixel_size_x = plate_len_x / npts_x
-        pixels_size_y = plate_len_y / npts_y
+    disp_fields = np.asarray(disp_fields)
+    n_frames, npts_x, npts_y = np.shape(disp_fields)
+    pixel_size_x = plate_len_x / npts_x
+    pixels_size_y = plate_len_y / npts_y
 
-        # calculate slopes
-        slope_x, slope_y = np.gradient(-disp_field, pixel_size_x, pixels_size_y)
+    if dtype is not None:
+        # The deflection fields are copied into the block
+        return _block_fieldStack_from_disp_fields(np.asarray(disp_fields, dtype=_float_dtype(disp_fields)),
+                                                  acceleration_fields, times, pixel_size_x, pixels_size_y, dtype,
+                                                  batch_size)
 
-        # calculate curvatures
-        aux_k_xx, aux_k_s12 = np.gradient(slope_x, pixel_size_x, pixels_size_y)
-        aux_k_s21, aux_k_yy = np.gradient(slope_y, pixel_size_x, pixels_size_y)
-        aux_k_xy = .5 * (aux_k_s12 + aux_k_s21)
+    # The stack holds a copy, such that it is not changed if the given deflection fields are modified later on
+    deflection = np.array(disp_fields, dtype=_float_dtype(disp_fields))
 
-        slopes_x.append(slope_x)
-        slopes_y.append(slope_y)
-        curv_xx.append(aux_k_xx)
-        curv_yy.append(aux_k_yy)
-        curv_xy.append(aux_k_xy)
-
-        deflection.append(disp_field)
+    # All frames are differentiated at once
+    slopes_x, slopes_y, curv_xx, curv_yy, curv_xy = _kinematics_from_disp_fields(deflection, pixel_size_x,
+                                                                                pixels_size_y)
 
     if acceleration_fields is None:
         # Assuming constant time-step size
         time_step_size = float(times[1]) - float(times[0])
-
-        vel_fields = np.gradient(deflection, axis=0) / time_step_size
-        accel_field = np.gradient(vel_fields, axis=0) / time_step_size
+        accel_field = _acceleration_from_disp_fields(deflection, time_step_size)
 
     else:
         accel_field = np.array(acceleration_fields)
 
-    deflection = np.array(deflection)
-    slopes_x = np.array(slopes_x)
-    slopes_y = np.array(slopes_y)
-    curv_xx = np.array(curv_xx)
-    curv_yy = np.array(curv_yy)
-    curv_xy = np.array(curv_xy)
-    accel_field = np.array(accel_field)
     times = np.array(times)
 
     return FieldStack(deflection, (slopes_x, slopes_y), (curv_xx, curv_yy, curv_xy), accel_field, times)
+
+
+def _block_fieldStack_from_disp_fields(deflection, acceleration_fields, times, pixel_size_x, pixel_size_y, dtype,
+                                       batch_size):
+    if type(batch_size) != int or batch_size < 1:
+        raise ValueError("The batch size has to be an integer larger or equal to 1")
+
+    n_frames, npts_x, npts_y = deflection.shape
+    block = np.empty((len(_stored_field_names), n_frames, npts_x, npts_y), dtype=dtype)
+    if acceleration_fields is None:
+        # Assuming constant time-step size
+        time_step_size = float(times[1]) - float(times[0])
+
+    for start in range(0, n_frames, batch_size):
+        stop = min(start + batch_size, n_frames)
+        block[0, start:stop] = deflection[start:stop]
+        for i, field in enumerate(_kinematics_from_disp_fields(deflection[start:stop], pixel_size_x, pixel_size_y)):
+            block[i + 1, start:stop] = field
+
+        if acceleration_fields is None:
+            # The accelerations of a batch depend on two frames on either side of the batch
+            halo_start = max(start - 2, 0)
+            halo_stop = min(stop + 2, n_frames)
+            block[6, start:stop] = _acceleration_from_disp_fields(deflection[halo_start:halo_stop], time_step_size)[
+                                   start - halo_start:stop - halo_start]
+        else:
+            block[6, start:stop] = acceleration_fields[start:stop]
+
+    return FieldStack.from_block(block, np.array(times))
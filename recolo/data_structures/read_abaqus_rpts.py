@@ -1,6 +1,15 @@
 import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
 import numpy as np
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain
 import logging
 from natsort import natsorted
 
@@ -24,22 +33,385 @@ def list_files_in_folder(path, file_type=".rpt",abs_path=False):
         return natsorted([file for file in os.listdir(path) if file.endswith(file_type)])
 
 
+AbaqusReport = namedtuple("AbaqusReport", ["time", "node_labels", "columns"])
 
+# The header line holding the column names, followed by the line of locations and a line of dashes
+_rpt_column_header = re.compile(r"^[ \t]*Node[ \t]+(.*)\n.*\n[ \t]*-+[ \t]*\n", re.MULTILINE)
+_rpt_step_time = re.compile(r"Step Time\s*=\s*(\S+)")
+_rpt_end_of_table = re.compile(r"\n[ \t]*\n")
 
-AbaqusData = namedtuple("AbaqusSimulation",
-                        ["disp_fields", "accel_fields", "slope_x_fields", "slope_y_fields", "times", "plate_len_x",
-                         "plate_len_y", "npts_x", "npts_y", "pixel_size_x", "pixel_size_y", "sampling_rate"])
+# The columns of the report which are used by load_abaqus_rpts
+_rpt_coord_x = "COORD.COOR1"
+_rpt_coord_y = "COORD.COOR2"
+_rpt_disp_z = "U.U3"
+_rpt_accel_z = "A.A3"
+_rpt_slope_x = "UR.UR1"
+_rpt_slope_y = "UR.UR2"
 
+# Coordinates closer than this fraction of the largest grid spacing are taken as the same grid line
+_rpt_coord_rel_tol = 1.e-3
 
-def load_abaqus_rpts(path_to_rpts, use_only_img_ids=None):
+
+def read_abaqus_rpt(path_to_rpt):
+    """
+    Read a nodal field output report written by Abaqus.
+    The file is read once, the step time and the column names are found in the header and the table of nodal
+    values is converted to floats in a single operation.
+
+    Parameters
+    ----------
+    path_to_rpt : str
+        Path to the .rpt file
+    Returns
+    -------
+    report : AbaqusReport
+        The step time, the node labels and a dict mapping the column names, e.g. "U.U3", to the nodal values
+    """
+    with open(path_to_rpt, "r") as rpt_file:
+        text = rpt_file.read()
+
+    step_time = _rpt_step_time.search(text)
+    if step_time is None:
+        raise ValueError("No step time was found in %s" % path_to_rpt)
+
+    header = _rpt_column_header.search(text)
+    if header is None:
+        raise ValueError("No table of nodal values was found in %s" % path_to_rpt)
+    column_names = ["Node"] + header.group(1).split()
+
+    # The table ends at the first blank line, after which a summary of the columns may follow
+    table = text[header.end():]
+    end_of_table = _rpt_end_of_table.search(table)
+    if end_of_table is not None:
+        table = table[:end_of_table.start()]
+
+    values = np.fromstring(table, sep=" ")
+    if values.size % len(column_names) != 0:
+        raise ValueError("The table of nodal values in %s does not have %i columns" % (path_to_rpt,
+                                                                                       len(column_names)))
+    values = values.reshape((-1, len(column_names)))
+
+    columns = {name: values[:, i] for i, name in enumerate(column_names[1:], start=1)}
+    return AbaqusReport(float(step_time.group(1)), values[:, 0].astype(int), columns)
+
+
+def _step_time_from_rpt(path_to_rpt):
+    """
+    Read the step time from the header of a report, without reading the table of nodal values.
+    """
+    with open(path_to_rpt, "r") as rpt_file:
+        for line in rpt_file:
+            step_time = _rpt_step_time.search(line)
+            if step_time is not None:
+                return float(step_time.group(1))
+            if line.lstrip().startswith("Node"):
+                break
+    raise ValueError("No step time was found in %s" % path_to_rpt)
+
+
+AbaqusFrame = namedtuple("AbaqusFrame", ["disp_field", "accel_field", "slope_x_field", "slope_y_field", "time"])
+
+
+class AbaqusData(namedtuple("AbaqusSimulation",
+                            ["disp_fields", "accel_fields", "slope_x_fields", "slope_y_fields", "times",
+                             "plate_len_x", "plate_len_y", "npts_x", "npts_y", "pixel_size_x", "pixel_size_y",
+                             "sampling_rate"])):
+    __slots__ = ()
+
+    def iter_frames(self):
+        """
+        Iterate over the frames of the simulation in order of time.
+        For data loaded with lazy=True, only the report of the current frame is parsed and kept in memory.
+
+        Returns
+        -------
+        frames : generator
+            Generator yielding the fields of every frame as AbaqusFrame objects
+        """
+        for frame_id in range(len(self.times)):
+            yield AbaqusFrame(self.disp_fields[frame_id], self.accel_fields[frame_id],
+                              self.slope_x_fields[frame_id], self.slope_y_fields[frame_id], self.times[frame_id])
+
+
+class _LazyReports(object):
+    def __init__(self, rpt_file_paths, node_grid, cache_size):
+        """
+        Parses the reports when the fields of a frame are requested, keeping the most recently used frames.
+        """
+        self.rpt_file_paths = rpt_file_paths
+        self.node_grid = node_grid
+        self._cache_size_ = cache_size
+        self._cache_ = OrderedDict()
+        self._lock_ = threading.Lock()
+
+    def fields(self, frame_id):
+        with self._lock_:
+            if frame_id in self._cache_:
+                self._cache_.move_to_end(frame_id)
+                return self._cache_[frame_id]
+
+        fields = _frame_from_rpt(self.rpt_file_paths[frame_id], self.node_grid)[3]
+
+        with self._lock_:
+            self._cache_[frame_id] = fields
+            while len(self._cache_) > self._cache_size_:
+                self._cache_.popitem(last=False)
+        return fields
+
+
+class LazyAbaqusFields(object):
+    def __init__(self, reports, field_id, shape):
+        """
+        Read-only stack of fields from a series of Abaqus reports, where a report is parsed when a frame is
+        requested. Indexing works as for an array with shape [frame,x,y], e.g. fields[10], fields[10:20] and
+        fields[:, 5:-5, 5:-5], and np.array(fields) loads all frames.
+
+        Parameters
+        ----------
+        reports : _LazyReports
+            The reports, shared by the fields of a simulation such that every report is only parsed once
+        field_id : int
+            The index of the field in the fields of a frame
+        shape : tuple
+            The shape of the stack of fields (n_frames, npts_x, npts_y)
+        """
+        self._reports_ = reports
+        self._field_id_ = field_id
+        self.shape = shape
+        self.ndim = len(shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _frame(self, frame_id):
+        return self._reports_.fields(frame_id)[self._field_id_]
+
+    def __getitem__(self, key):
+        time_key, field_key = (key[0], key[1:]) if isinstance(key, tuple) else (key, ())
+        if isinstance(time_key, slice):
+            frame_ids = range(*time_key.indices(len(self)))
+            fields = np.empty((len(frame_ids),) + np.empty(self.shape[1:])[field_key].shape)
+            for i, frame_id in enumerate(frame_ids):
+                fields[i] = self._frame(frame_id)[field_key]
+            return fields
+
+        frame_id = range(len(self))[time_key]
+        return self._frame(frame_id)[field_key]
+
+    def __iter__(self):
+        return (self[frame_id] for frame_id in range(len(self)))
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+
+_cache_folder_name = ".recolo_cache"
+_cache_format = "recolo.AbaqusData"
+_cache_format_version = 1
+_cached_field_names = ("disp_fields", "accel_fields", "slope_x_fields", "slope_y_fields", "times")
+_cache_key_pattern = re.compile(r"[0-9a-f]{40}")
+
+
+def _cache_key(rpt_file_paths):
+    """
+    Key identifying a selection of reports by the names, the sizes and the modification times of the files.
+    """
+    file_stats = [(os.path.basename(path), os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in
+                  rpt_file_paths]
+    return hashlib.sha1(json.dumps([_cache_format_version, file_stats]).encode()).hexdigest()
+
+
+def _load_cache(cache_path):
+    """
+    Load the cached fields as read-only memory maps, or return None if there is no valid cache.
+    """
+    try:
+        with open(os.path.join(cache_path, "metadata.json"), "r") as metadata_file:
+            metadata = json.load(metadata_file)
+    except (OSError, ValueError):
+        return None
+
+    if metadata.get("format") != _cache_format or metadata.get("version") != _cache_format_version:
+        return None
+
+    try:
+        fields = {name: np.load(os.path.join(cache_path, name + ".npy"), mmap_mode="r") for name in
+                  _cached_field_names}
+    except (OSError, ValueError):
+        # Missing or truncated files
+        return None
+    return AbaqusData(**fields, **metadata["scalars"])
+
+
+def _save_cache(cache_path, abaqus_data):
+    """
+    Store the fields as .npy files. The files are written to a temporary folder which is then renamed, such
+    that an incomplete cache is never read. Only a single cache is kept per folder, such that the caches of
+    previous versions of the reports are removed.
+    """
+    cache_folder = os.path.dirname(cache_path)
+    os.makedirs(cache_folder, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=cache_folder)
+    try:
+        for name in _cached_field_names:
+            np.save(os.path.join(tmp_path, name + ".npy"), getattr(abaqus_data, name))
+
+        scalars = {name: getattr(abaqus_data, name) for name in AbaqusData._fields if
+                   name not in _cached_field_names}
+        metadata = {"format": _cache_format, "version": _cache_format_version,
+                    "scalars": {name: int(value) if isinstance(value, (int, np.integer)) else float(value) for
+                                name, value in scalars.items()}}
+        with open(os.path.join(tmp_path, "metadata.json"), "w") as metadata_file:
+            json.dump(metadata, metadata_file)
+        # An existing cache with the same key is damaged, as it would have been loaded otherwise
+        shutil.rmtree(cache_path, ignore_errors=True)
+        os.replace(tmp_path, cache_path)
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    for name in os.listdir(cache_folder):
+        # Temporary folders of other processes writing to the cache are left alone
+        if _cache_key_pattern.fullmatch(name) and name != os.path.basename(cache_path):
+            shutil.rmtree(os.path.join(cache_folder, name), ignore_errors=True)
+
+
+_NodeGrid = namedtuple("_NodeGrid", ["node_labels", "order", "shape"])
+
+
+def _report_columns(report, path_to_rpt):
+    try:
+        return [report.columns[name] for name in
+                (_rpt_coord_x, _rpt_coord_y, _rpt_disp_z, _rpt_accel_z, _rpt_slope_x, _rpt_slope_y)]
+    except KeyError as missing_column:
+        raise ValueError("The column %s is missing in %s" % (missing_column, path_to_rpt))
+
+
+def _coordinate_ids(node_coords):
+    """
+    Group the coordinates of the nodes along one axis into grid lines, returning the index of the grid line of
+    every node and the number of grid lines. Sorted coordinates which are closer than a small fraction of the largest
+    spacing between the grid lines are taken as the same grid line, such that rounding in the reports is ignored.
+    """
+    order = np.argsort(node_coords, kind="stable")
+    gaps = np.diff(node_coords[order])
+    tolerance = _rpt_coord_rel_tol * gaps.max() if len(gaps) > 0 else 0.
+    sorted_ids = np.concatenate([[0], np.cumsum(gaps > tolerance)])
+
+    coord_ids = np.empty(len(node_coords), dtype=int)
+    coord_ids[order] = sorted_ids
+    return coord_ids, int(sorted_ids[-1]) + 1
+
+
+def _node_grid_from_report(report, path_to_rpt):
+    """
+    Determine the permutation which gathers the nodal values of a report into a regular grid, where the rows
+    follow the COOR2 coordinate and the columns follow the COOR1 coordinate. The grid can be rectangular and the
+    nodes can be given in any order.
+    """
+    node_coord_x, node_coord_y = _report_columns(report, path_to_rpt)[:2]
+    col_ids, n_cols = _coordinate_ids(node_coord_x)
+    row_ids, n_rows = _coordinate_ids(node_coord_y)
+    shape = (n_rows, n_cols)
+    n_nodes = shape[0] * shape[1]
+
+    grid_ids = row_ids * shape[1] + col_ids
+    if len(grid_ids) != n_nodes or np.any(np.bincount(grid_ids, minlength=n_nodes) != 1):
+        raise ValueError("The nodes in %s are not on a regular grid" % path_to_rpt)
+
+    order = np.empty(n_nodes, dtype=int)
+    order[grid_ids] = np.arange(n_nodes)
+    return _NodeGrid(report.node_labels, order, shape)
+
+
+def _frame_from_report(report, node_grid, path_to_rpt):
+    """
+    Gather the deflection, acceleration and slope fields of a report into the grid determined from the first
+    report, and determine the plate lengths along the two axes of the fields.
+    """
+    if not np.array_equal(report.node_labels, node_grid.node_labels):
+        raise ValueError("The report %s does not have the same nodes as the first report" % path_to_rpt)
+
+    node_coord_x, node_coord_y, node_disp_z, node_acceleration_z, node_slope_x, node_slope_y = _report_columns(
+        report, path_to_rpt)
+
+    # The first axis of the fields follows COOR2 and the second axis follows COOR1
+    plate_len_x = (node_coord_y.max() - node_coord_y.min()) * 1e-3
+    plate_len_y = (node_coord_x.max() - node_coord_x.min()) * 1e-3
+
+    fields = [-node_field[node_grid.order].reshape(node_grid.shape) * 1e-3 for node_field in
+              (node_disp_z, node_acceleration_z, node_slope_x, node_slope_y)]
+    return report.time, plate_len_x, plate_len_y, fields
+
+
+def _frame_from_rpt(path_to_rpt, node_grid):
+    """
+    Read the time, the plate lengths and the deflection, acceleration and slope fields from an Abaqus report.
+    This is a module level function such that it can be run by the workers of a process pool.
+    """
+    return _frame_from_report(read_abaqus_rpt(path_to_rpt), node_grid, path_to_rpt)
+
+
+def _read_frames(rpt_file_paths, node_grid, workers):
+    """
+    Read the reports in order, either one by one or by a pool of worker processes.
+    """
+    if workers is None:
+        for path_to_rpt in rpt_file_paths:
+            yield _frame_from_rpt(path_to_rpt, node_grid)
+        return
+
+    chunk_size = max(len(rpt_file_paths) // (4 * workers), 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # The results are returned in the order of the files, regardless of the order in which they are parsed
+        for frame in pool.map(partial(_frame_from_rpt, node_grid=node_grid), rpt_file_paths, chunksize=chunk_size):
+            yield frame
+
+
+def _lazy_abaqus_data(rpt_file_paths, cache_size):
+    """
+    AbaqusData where the fields are parsed from the reports when a frame is requested. Only the headers of the
+    reports are read for the times, and the plate dimensions are taken from the last report, as for the eager data.
+    """
+    times = np.array([_step_time_from_rpt(path_to_rpt) for path_to_rpt in rpt_file_paths])
+    node_grid = _node_grid_from_report(read_abaqus_rpt(rpt_file_paths[0]), rpt_file_paths[0])
+    reports = _LazyReports(rpt_file_paths, node_grid, cache_size)
+    _, plate_len_x, plate_len_y, fields = _frame_from_rpt(rpt_file_paths[-1], node_grid)
+
+    shape = (len(rpt_file_paths),) + node_grid.shape
+    npts_x, npts_y = shape[1:]
+    lazy_fields = [LazyAbaqusFields(reports, field_id, shape) for field_id in range(len(fields))]
+
+    return AbaqusData(*lazy_fields, times, plate_len_x, plate_len_y, npts_x, npts_y, plate_len_x / float(npts_x),
+                      plate_len_y / float(npts_y), 1. / (times[1] - times[0]))
+
+
+def load_abaqus_rpts(path_to_rpts, use_only_img_ids=None, workers=None, cache=False, lazy=False, cache_size=4):
     """
     Load Abaqus RPT files into a AbaqusData object containing all relevant fields
+
+    The parsed fields can be cached as .npy files in the folder ".recolo_cache" within the folder of the reports.
+    The cache is identified by the names, the sizes and the modification times of the selected files, such that
+    the reports are parsed again if any of them are changed. When the cache is valid, the fields are returned as
+    read-only memory maps of the cached files.
+
+    For simulations with many increments, the reports can instead be loaded lazily, where the fields are given as
+    LazyAbaqusFields which are indexed as arrays, but parse a report only when that frame is requested. Iterating
+    over the frames by AbaqusData.iter_frames then only keeps a few reports in memory at a time.
     Parameters
     ----------
     path_to_rpts : str
         Path to the folder containing the files
     use_only_img_ids : list
         A list of file ids which should be included in the AbaqusData object
+    workers : int
+        The number of worker processes used to parse the files. The files are parsed one by one if "None".
+    cache : bool
+        Load the fields from the cache if it is valid, and store the fields in the cache otherwise
+    lazy : bool
+        Parse the reports when the fields of a frame are requested. Cannot be combined with the cache.
+    cache_size : int
+        The number of parsed frames kept in memory when loading lazily
     Returns
     -------
     abaqusData : AbaqusData
@@ -47,56 +419,68 @@ def load_abaqus_rpts(path_to_rpts, use_only_img_ids=None):
     """
     logger = logging.getLogger(__name__)
 
+    if workers is not None and (type(workers) != int or workers < 1):
+        raise ValueError("The number of workers has to be an integer larger or equal to 1")
+
+    if lazy and cache:
+        raise ValueError("Lazily loaded reports cannot be cached")
+
+    if type(cache_size) != int or cache_size < 1:
+        raise ValueError("The cache size has to be an integer larger or equal to 1")
+
     rpt_file_paths = list_files_in_folder(path_to_rpts, file_type=".rpt",abs_path=True)
     logger.info("Reading %i Abaqus .rpt files" % len(rpt_file_paths))
 
-    disp_fields = []
-    slope_x_fields = []
-    slope_y_fields = []
-    accel_fields = []
-    times = []
-
     if use_only_img_ids is not None:
-        rpt_file_paths = [path for i, path in enumerate(rpt_file_paths) if i in use_only_img_ids]
+        selected_ids = set(use_only_img_ids)
+        rpt_file_paths = [path for i, path in enumerate(rpt_file_paths) if i in selected_ids]
+
+    if len(rpt_file_paths) == 0:
+        raise ValueError("No .rpt files were found in %s" % path_to_rpts)
+
+    if lazy:
+        return _lazy_abaqus_data(rpt_file_paths, cache_size)
 
-    for file_name in rpt_file_paths:
+    if cache:
+        cache_path = os.path.join(path_to_rpts, _cache_folder_name, _cache_key(rpt_file_paths))
+        abaqus_data = _load_cache(cache_path)
+        if abaqus_data is not None:
+            logger.info("Loading the fields from the cache in %s" % cache_path)
+            return abaqus_data
+
+    n_frames = len(rpt_file_paths)
+    times = np.zeros(n_frames)
+
+    # The grid is determined once from the coordinates of the first report and is shared by all frames
+    first_report = read_abaqus_rpt(rpt_file_paths[0])
+    node_grid = _node_grid_from_report(first_report, rpt_file_paths[0])
+    disp_fields, accel_fields, slope_x_fields, slope_y_fields = [np.empty((n_frames,) + node_grid.shape) for _ in
+                                                                 range(4)]
+
+    frames = chain([_frame_from_report(first_report, node_grid, rpt_file_paths[0])],
+                   _read_frames(rpt_file_paths[1:], node_grid, workers))
+    for frame_id, (file_name, frame) in enumerate(zip(rpt_file_paths, frames)):
         logger.info("Reading: %s " % file_name)
-        path_to_rpt = os.path.join(path_to_rpts, file_name)
-        field_data = np.genfromtxt(path_to_rpt, dtype=float,
-                                   skip_header=19)
-
-        time = np.genfromtxt(path_to_rpt, dtype=str, skip_header=8, max_rows=1)[-1]
-
-        node_label = field_data[:, 0]
-        node_coord_x = field_data[:, 1]
-        node_coord_y = field_data[:, 2]
-        node_disp_z = field_data[:, 3]
-        node_acceleration_z = field_data[:, 4]
-        node_slope_x = field_data[:, 5]
-        node_slope_y = field_data[:, 6]
-
-        # All data is assumed to be sampled on a square grid
-        seed = int(node_disp_z.size ** 0.5)
-
-        plate_len_x = (node_coord_x.max() - node_coord_x.min()) * 1e-3
-        plate_len_y = (node_coord_y.max() - node_coord_y.min()) * 1e-3
-
-        disp_field = -node_disp_z.reshape((seed, seed)) * 1e-3
-        accel_field = -node_acceleration_z.reshape((seed, seed)) * 1e-3
-        slope_x_field = -node_slope_x.reshape((seed, seed)) * 1e-3
-        slope_y_field = -node_slope_y.reshape((seed, seed)) * 1e-3
-
-        disp_fields.append(disp_field)
-        accel_fields.append(accel_field)
-        times.append(float(time))
-        slope_x_fields.append(slope_x_field)
-        slope_y_fields.append(slope_y_field)
+        times[frame_id], plate_len_x, plate_len_y, fields = frame
+
+        for stack, field in zip((disp_fields, accel_fields, slope_x_fields, slope_y_fields), fields):
+            stack[frame_id] = field
+
     npts_x = np.shape(disp_fields)[1]
     npts_y = np.shape(disp_fields)[2]
     pixel_size_x = plate_len_x / float(npts_x)
     pixel_size_y = plate_len_y / float(npts_y)
     sampling_rate = 1. / (times[1] - times[0])
 
-    return AbaqusData(np.array(disp_fields), np.array(accel_fields), np.array(slope_x_fields), np.array(slope_y_fields),
-                      np.array(times), plate_len_x, plate_len_y, npts_x, npts_y, pixel_size_x, pixel_size_y,
-                      sampling_rate)
+    abaqus_data = AbaqusData(disp_fields, accel_fields, slope_x_fields, slope_y_fields,
+                             times, plate_len_x, plate_len_y, npts_x, npts_y, pixel_size_x, pixel_size_y,
+                             sampling_rate)
+
+    if cache:
+        try:
+            _save_cache(cache_path, abaqus_data)
+            logger.info("Stored the fields in the cache in %s" % cache_path)
+        except OSError as error:
+            logger.warning("The fields could not be cached: %s" % error)
+
+    return abaqus_data
@@ -0,0 +1,99 @@
+import numpy as np
+from scipy import fft
+
+
+def fft_shape(field_shape, kernel_shape):
+    """
+    Determine the padded shape of the transforms used for linear convolution of a field with a kernel.
+
+    The shape is large enough to avoid wrap-around and is rounded up to sizes which are fast for real-to-complex
+    transforms.
+
+    Parameters
+    ----------
+    field_shape : tuple
+        The spatial shape of the field (n_pts_x, n_pts_y)
+    kernel_shape : tuple
+        The shape of the convolution kernel (n_pts_x, n_pts_y)
+
+    Returns
+    -------
+    shape : tuple
+        The padded shape of the transforms
+    """
+    return tuple(fft.next_fast_len(int(n_field + n_kernel - 1), real=True) for n_field, n_kernel in
+                 zip(field_shape, kernel_shape))
+
+
+def rfft_fields(fields, shape, workers=None):
+    """
+    Real-to-complex transform of a field or a stack of fields over the two last axes.
+
+    Parameters
+    ----------
+    fields : ndarray
+        The fields with shape (..., n_pts_x, n_pts_y)
+    shape : tuple
+        The padded shape of the transform, see fft_shape
+    workers : int
+        The number of threads used by scipy.fft
+
+    Returns
+    -------
+    spectra : ndarray
+        The spectra with shape (..., shape[0], shape[1]//2+1)
+    """
+    return fft.rfft2(fields, s=shape, axes=(-2, -1), workers=workers)
+
+
+def irfft_valid(spectra, shape, field_shape, kernel_shape, workers=None):
+    """
+    Inverse transform of convolution spectra, returning only the part of the result which corresponds to
+    the "valid" mode of scipy.signal.convolve2d.
+
+    Parameters
+    ----------
+    spectra : ndarray
+        The spectra with shape (..., shape[0], shape[1]//2+1)
+    shape : tuple
+        The padded shape of the transform, see fft_shape
+    field_shape : tuple
+        The spatial shape of the convolved field (n_pts_x, n_pts_y)
+    kernel_shape : tuple
+        The shape of the convolution kernel (n_pts_x, n_pts_y)
+    workers : int
+        The number of threads used by scipy.fft
+
+    Returns
+    -------
+    fields : ndarray
+        The convolved fields with shape (..., n_pts_x - kernel_x + 1, n_pts_y - kernel_y + 1)
+    """
+    full = fft.irfft2(spectra, s=shape, axes=(-2, -1), workers=workers)
+    return full[..., kernel_shape[0] - 1:field_shape[0], kernel_shape[1] - 1:field_shape[1]]
+
+
+def fft_convolve_valid(fields, kernel, workers=None):
+    """
+    Convolve a field or a stack of fields with a kernel using real-to-complex FFTs.
+    The result is equal to that of scipy.signal.convolve2d(field, kernel, mode="valid") for every field.
+
+    Parameters
+    ----------
+    fields : ndarray
+        The fields with shape (..., n_pts_x, n_pts_y)
+    kernel : ndarray
+        The kernel with shape (n_pts_x, n_pts_y)
+    workers : int
+        The number of threads used by scipy.fft
+
+    Returns
+    -------
+    fields : ndarray
+        The convolved fields
+    """
+    field_shape = np.shape(fields)[-2:]
+    kernel_shape = np.shape(kernel)
+    shape = fft_shape(field_shape, kernel_shape)
+    spectra = rfft_fields(fields, shape, workers) * rfft_fields(kernel, shape, workers)
+    return irfft_valid(spectra, shape, field_shape, kernel_shape, workers)
@@ -0,0 +1,32 @@
+from scipy import ndimage
+
+
+def separable_convolve_valid(fields, factor_x, factor_y):
+    """
+    Convolve a field or a stack of fields with a separable kernel, np.outer(factor_x, factor_y), as two
+    one-dimensional passes along the two last axes.
+    The result is equal to that of scipy.signal.convolve2d(field, np.outer(factor_x, factor_y), mode="valid")
+    for every field, but the cost scales with the kernel size and not the kernel area.
+
+    Parameters
+    ----------
+    fields : ndarray
+        The fields with shape (..., n_pts_x, n_pts_y)
+    factor_x : ndarray
+        The factor of the kernel along the x-axis
+    factor_y : ndarray
+        The factor of the kernel along the y-axis
+
+    Returns
+    -------
+    fields : ndarray
+        The convolved fields with shape (..., n_pts_x - len(factor_x) + 1, n_pts_y - len(factor_y) + 1)
+    """
+    n_pts_x, n_pts_y = fields.shape[-2:]
+    start_x = (len(factor_x) - 1) // 2
+    start_y = (len(factor_y) - 1) // 2
+
+    fields = ndimage.convolve1d(fields, factor_x, axis=-2, mode="constant")
+    fields = fields[..., start_x:start_x + n_pts_x - len(factor_x) + 1, :]
+    fields = ndimage.convolve1d(fields, factor_y, axis=-1, mode="constant")
+    return fields[..., start_y:start_y + n_pts_y - len(factor_y) + 1]
@@ -0,0 +1,224 @@
+import numpy as np
+from scipy.ndimage import convolve1d
+from scipy.signal import savgol_coeffs, lfilter
+
+
+def gaussian_derivative_kernel(sigma, order):
+    """
+    Sampled gaussian kernel or gaussian derivative kernel truncated at four standard deviations.
+    The kernels are corrected such that their discrete moments are exact, i.e. the derivative kernels return
+    exactly zero for constant fields and the correct derivative for linear and quadratic fields.
+
+    Parameters
+    ----------
+    sigma : float
+        The standard deviation of the gaussian in samples
+    order : int
+        The order of the derivative, either 0, 1 or 2
+
+    Returns
+    -------
+    kernel : ndarray
+        The convolution kernel with 2 * int(4 * sigma + 0.5) + 1 samples
+    """
+    radius = int(4 * sigma + 0.5)
+    xs = np.arange(-radius, radius + 1, dtype=float)
+    gauss = np.exp(-0.5 / sigma ** 2. * xs ** 2.)
+    gauss = gauss / np.sum(gauss)
+
+    if order == 0:
+        return gauss
+    elif order == 1:
+        kernel = -xs / sigma ** 2. * gauss
+        return kernel / -np.sum(kernel * xs)
+    elif order == 2:
+        kernel = (xs ** 2. / sigma ** 4. - 1. / sigma ** 2.) * gauss
+        kernel = kernel - np.sum(kernel) * gauss
+        return kernel / np.sum(kernel * xs ** 2. / 2.)
+    raise ValueError("Only gaussian derivatives of order 0, 1 and 2 are supported")
+
+
+def gaussian_temporal_kernels(sigma, time_step_size):
+    """
+    Kernels giving the gaussian smoothed fields and their first and second time derivatives.
+
+    Parameters
+    ----------
+    sigma : float
+        The standard deviation of the gaussian in frames
+    time_step_size : float
+        The time between two frames
+
+    Returns
+    -------
+    kernels : tuple
+        The kernels for the smoothed fields, the first time derivative and the second time derivative
+    """
+    return tuple(gaussian_derivative_kernel(sigma, order) / time_step_size ** order for order in range(3))
+
+
+def savgol_temporal_kernels(window_length, polyorder, time_step_size):
+    """
+    Savitzky-Golay kernels giving the smoothed fields and their first and second time derivatives, based on a
+    least squares fit of a polynomial to the frames within a window.
+
+    Parameters
+    ----------
+    window_length : int
+        The number of frames in the window. Has to be an odd number.
+    polyorder : int
+        The order of the polynomial. Has to be at least 2 and less than the window length.
+    time_step_size : float
+        The time between two frames
+
+    Returns
+    -------
+    kernels : tuple
+        The kernels for the smoothed fields, the first time derivative and the second time derivative
+    """
+    if type(window_length) != int or window_length % 2 != 1:
+        raise ValueError("The window length has to be an odd integer")
+    if polyorder < 2 or polyorder >= window_length:
+        raise ValueError("The polynomial order has to be at least 2 and less than the window length")
+    return tuple(savgol_coeffs(window_length, polyorder, deriv=order, delta=time_step_size, use="conv") for order in
+                 range(3))
+
+
+def temporal_derivatives(fields, kernels, chunk_size=None, out=None):
+    """
+    Convolve a stack of fields with a set of kernels along the time axis, giving for instance the smoothed fields,
+    the velocity and the acceleration in a single pass over the stack.
+
+    The stack can be processed in chunks of frames, where every chunk is read once together with the halo frames
+    needed by the kernels. The results are the same as for the whole stack, such that stacks stored as memory maps
+    can be processed without loading them into memory. The frames beyond the ends of the stack are taken as the
+    first and the last frame.
+
+    Parameters
+    ----------
+    fields : ndarray
+        The fields with shape (n_frames, n_pts_x, n_pts_y)
+    kernels : tuple
+        The convolution kernels with an odd number of samples, see gaussian_temporal_kernels and
+        savgol_temporal_kernels
+    chunk_size : int
+        The number of frames processed at once. Defaults to all frames.
+    out : tuple
+        Preallocated arrays, one per kernel, with the same shape as the fields in which the results are stored.
+        These can be memory maps.
+
+    Returns
+    -------
+    results : tuple
+        The convolved fields for every kernel
+    """
+    if any(len(kernel) % 2 != 1 for kernel in kernels):
+        raise ValueError("The kernels have to have an odd number of samples")
+
+    n_frames = len(fields)
+    chunk_size = n_frames if chunk_size is None else chunk_size
+    if type(chunk_size) != int or chunk_size < 1:
+        raise ValueError("The chunk size has to be an integer larger or equal to 1")
+
+    if out is None:
+        out = tuple(np.empty(np.shape(fields)) for _ in kernels)
+    elif len(out) != len(kernels) or any(np.shape(result) != np.shape(fields) for result in out):
+        raise ValueError("One output array with the same shape as the fields has to be given per kernel")
+
+    halo = max(len(kernel) for kernel in kernels) // 2
+    for start in range(0, n_frames, chunk_size):
+        stop = min(start + chunk_size, n_frames)
+        halo_start = max(start - halo, 0)
+        halo_stop = min(stop + halo, n_frames)
+        chunk = np.asarray(fields[halo_start:halo_stop], dtype=float)
+        for kernel, result in zip(kernels, out):
+            result[start:stop] = convolve1d(chunk, kernel, axis=0, mode="nearest")[
+                                 start - halo_start:stop - halo_start]
+
+    return tuple(out)
+
+
+def causal_smoothing_factor(sigma, n_stages):
+    """
+    The smoothing factor alpha of a cascade of exponential moving averages, y[i] = alpha x[i] + (1-alpha) y[i-1],
+    which has an impulse response with the given standard deviation. Every stage has the variance
+    (1-alpha)/alpha^2, such that the factor is the positive root of sigma^2 alpha^2 + n alpha - n = 0.
+
+    Parameters
+    ----------
+    sigma : float
+        The standard deviation of the impulse response of the cascade in frames
+    n_stages : int
+        The number of stages in the cascade
+
+    Returns
+    -------
+    alpha : float
+        The smoothing factor of every stage
+    """
+    if sigma <= 0:
+        raise ValueError("The standard deviation has to be larger than zero")
+    return (-n_stages + np.sqrt(n_stages ** 2. + 4. * n_stages * sigma ** 2.)) / (2. * sigma ** 2.)
+
+
+class CausalTemporalFilter(object):
+    def __init__(self, sigma, n_stages=3):
+        """
+        Causal low-pass filter along the time axis, implemented as a cascade of exponential moving averages.
+        The impulse response approaches a gaussian with the given standard deviation as the number of stages
+        increases, but only depends on the current and the past frames. The filter can therefore be applied frame
+        by frame, or chunk by chunk, while the recording is running, keeping only one field per stage as state.
+
+        The filtered fields lag behind the input by the mean delay of the impulse response, given by the delay
+        attribute in frames. The state is initialised by the first frame, such that a constant signal passes
+        through the filter unchanged.
+
+        Parameters
+        ----------
+        sigma : float
+            The standard deviation of the impulse response in frames
+        n_stages : int
+            The number of exponential moving averages in the cascade
+        """
+        if type(n_stages) != int or n_stages < 1:
+            raise ValueError("The number of stages has to be an integer larger or equal to 1")
+
+        self.sigma = sigma
+        self.n_stages = n_stages
+        self.alpha = causal_smoothing_factor(sigma, n_stages)
+        self.delay = n_stages * (1. - self.alpha) / self.alpha
+        self._state_ = None
+
+    def reset(self):
+        """
+        Forget the past frames, such that the next frame initialises the filter.
+        """
+        self._state_ = None
+
+    def __call__(self, fields):
+        """
+        Filter the next chunk of frames.
+
+        Parameters
+        ----------
+        fields : ndarray
+            The next frames with shape (n_frames, n_pts_x, n_pts_y)
+
+        Returns
+        -------
+        fields : ndarray
+            The filtered frames, which are the same as if all frames since the last reset were filtered at once
+        """
+        fields = np.asarray(fields, dtype=float)
+        if len(fields) == 0:
+            return fields.copy()
+
+        if self._state_ is None:
+            self._state_ = [(1. - self.alpha) * fields[:1] for _ in range(self.n_stages)]
+        elif np.shape(fields)[1:] != np.shape(self._state_[0])[1:]:
+            raise ValueError("The fields have to have the same shape as the previous frames")
+
+        b, a = [self.alpha], [1., self.alpha - 1.]
+        for stage in range(self.n_stages):
+            fields, self._state_[stage] = lfilter(b, a, fields, axis=0, zi=self._state_[stage])
+        return fields
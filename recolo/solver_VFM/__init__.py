@@ -1 +1,9 @@
-from .dyn_thin_plate import calc_pressure_thin_elastic_plate
\ No newline at end of file
+
+
+from .dyn_thin_plate import calc_pressure_thin_elastic_plate
+from .stack_solver import calc_pressure_thin_elastic_plate_stack, calc_pressure_basis_thin_elastic_plate_stack, \
+    pressure_from_basis, PressureBasis, calc_pressure_thin_elastic_plate_window_sweep
+from .deflection_solver import calc_pressure_thin_elastic_plate_from_deflections
+from .probes import calc_pressure_thin_elastic_plate_probes
+from .probes import calc_force_thin_elastic_plate_regions
+from .parallel import calc_pressure_thin_elastic_plate_parallel
@@ -0,0 +1,180 @@
+import numpy as np
+from scipy import ndimage
+from scipy.signal import convolve2d
+import logging
+import recolo
+from recolo.math_tools.fft_convolution import fft_shape, rfft_fields, irfft_valid
+
+
+def _pad_gradient_edges(fields):
+    """
+    Pad the two last axes of the fields by two pixels such that central differences on the padded fields
+    reproduce the one-sided differences used by np.gradient at the edges of the original fields. This holds for
+    the first and the second derivatives, as long as there are at least three points along each axis.
+    """
+    fields = np.asarray(fields, dtype=float)
+    for axis in (-2, -1):
+        fields = np.moveaxis(fields, axis, 0)
+        first, second, third = fields[0], fields[1], fields[2]
+        last, second_last, third_last = fields[-1], fields[-2], fields[-3]
+        before = [4. * first - 4. * second + third, 2. * first - second]
+        after = [2. * last - second_last, 4. * last - 4. * second_last + third_last]
+        fields = np.concatenate([np.array(before), fields, np.array(after)], axis=0)
+        fields = np.moveaxis(fields, 0, axis)
+    return fields
+
+
+def _curvature_stencils(pixel_size):
+    """
+    The convolution kernels calculating the curvatures curv_xx, curv_yy and curv_xy from a deflection field
+    in the same manner as fieldStack_from_disp_fields.
+    """
+    gradient = np.array([1., 0., -1.]) / (2. * pixel_size)
+    second_derivative = np.convolve(gradient, gradient)
+
+    stencil_xx = np.zeros((5, 5))
+    stencil_yy = np.zeros((5, 5))
+    stencil_xy = np.zeros((5, 5))
+    stencil_xx[:, 2] = -second_derivative
+    stencil_yy[2, :] = -second_derivative
+    stencil_xy[1:4, 1:4] = -np.outer(gradient, gradient)
+    return stencil_xx, stencil_yy, stencil_xy
+
+
+def stiffness_kernel(plate, virtual_fields, pixel_size):
+    """
+    Fuse the virtual curvature fields, the bending stiffness of the plate and the finite difference stencils
+    used to calculate the curvatures into a single kernel which is convolved with the deflection field.
+
+    Parameters
+    ----------
+    plate : Plate object
+        The plate metrics
+    virtual_fields : Virtual fields object
+        The virtual fields
+    pixel_size : float
+        The physical pixel size of the deflection fields
+
+    Returns
+    -------
+    kernel : ndarray
+        The stiffness kernel, being four pixels larger than the virtual fields along each axis
+    """
+    stencil_xx, stencil_yy, stencil_xy = _curvature_stencils(pixel_size)
+
+    def conv(virtual_field, stencil):
+        return convolve2d(virtual_field, stencil, mode="full")
+
+    A11 = conv(virtual_fields.curv_xx, stencil_xx) + conv(virtual_fields.curv_yy, stencil_yy) + 2. * conv(
+        virtual_fields.curv_xy, stencil_xy)
+    A12 = conv(virtual_fields.curv_xx, stencil_yy) + conv(virtual_fields.curv_yy, stencil_xx) - 2. * conv(
+        virtual_fields.curv_xy, stencil_xy)
+    return A11 * plate.bend_stiff_11 + A12 * plate.bend_stiff_12
+
+
+def calc_pressure_thin_elastic_plate_from_deflections(defl_fields, plate, virtual_fields, pixel_size,
+                                                      sampling_rate, acceleration_fields=None, shift=False,
+                                                      batch_size=8, workers=None):
+    """
+    Calculate the pressure fields directly from a stack of deflection fields, without determining the slope and
+    curvature fields.
+    The stiffness term of the virtual fields method is obtained by a single convolution of the deflection fields
+    with a kernel fusing the virtual curvature fields, the bending stiffness and the finite difference stencils.
+    The inertia term is obtained by differentiating the convolution of the deflection fields and the virtual
+    deflection field twice with respect to time.
+
+    The results are the same as those obtained by kinematic_fields_from_deflections followed by
+    calc_pressure_thin_elastic_plate for every frame.
+
+    Parameters
+    ----------
+    defl_fields : ndarray
+        The deflection fields with shape [frame,x,y]
+    plate : Plate object
+        The plate metrics
+    virtual_fields : Virtual fields object
+        The virtual fields
+    pixel_size : float
+        The physical pixel size of the deflection fields
+    sampling_rate : float
+        The sampling rate at which the fields are acquired
+    acceleration_fields : ndarray (Optional)
+        The acceleration fields with shape [frame,x,y]
+        If given, the acceleration fields are not determined by differentiation
+        of the deflection fields along the time axis.
+    shift : bool
+        Correct for 0.5 pixel shift using bicubic spline interpolation
+    batch_size : int
+        The number of frames which are transformed at once
+    workers : int
+        The number of threads used by scipy.fft
+
+    Returns
+    -------
+    press : ndarray
+        The reconstructed pressure fields with shape (n_frames, n_pts_x, n_pts_y)
+    """
+    logger = logging.getLogger(__name__)
+    if not isinstance(plate, recolo.data_structures.plate.Plate):
+        raise IOError("The plate metrics have to be given as an instance of the Plate class")
+
+    if not isinstance(virtual_fields, recolo.virtual_fields.Hermite16):
+        raise IOError("The virtual fields have to be given as an instance of the Hermite16 class")
+
+    if shift and virtual_fields.centered:
+        raise ValueError("The virtual fields are already centered on the pixels and cannot be shifted")
+
+    if np.ndim(defl_fields) != 3:
+        raise ValueError("The deflection fields have to have the shape (n_frames,n_pix_x,n_pix_y)")
+
+    if type(batch_size) != int or batch_size < 1:
+        raise ValueError("The batch size has to be an integer larger or equal to 1")
+
+    n_frames, n_pts_x, n_pts_y = np.shape(defl_fields)
+    if acceleration_fields is None and n_frames < 2:
+        raise ValueError("At least two frames are needed to determine the accelerations")
+
+    stiff_kernel = stiffness_kernel(plate, virtual_fields, pixel_size)
+    # The virtual deflection field is zero-padded such that it can be applied to the padded deflection fields
+    defl_kernel = np.pad(virtual_fields.deflection, 2)
+
+    padded_shape = (n_pts_x + 4, n_pts_y + 4)
+    kernel_shape = np.shape(stiff_kernel)
+    shape = fft_shape(padded_shape, kernel_shape)
+    stiff_spectrum = rfft_fields(stiff_kernel, shape, workers)
+    defl_spectrum = rfft_fields(defl_kernel, shape, workers)
+    U3 = np.sum(virtual_fields.deflection)
+
+    out_shape = (n_frames, n_pts_x - virtual_fields.deflection.shape[0] + 1,
+                 n_pts_y - virtual_fields.deflection.shape[1] + 1)
+    press = np.zeros(out_shape)
+    virtual_inertia = np.zeros(out_shape)
+
+    for start in range(0, n_frames, batch_size):
+        stop = min(start + batch_size, n_frames)
+        logger.info("Reconstructing pressure for frame %i to %i" % (start, stop - 1))
+        deflection = rfft_fields(_pad_gradient_edges(defl_fields[start:stop]), shape, workers)
+        press[start:stop] = irfft_valid(deflection * stiff_spectrum, shape, padded_shape, kernel_shape, workers)
+
+        if acceleration_fields is None:
+            virtual_inertia[start:stop] = irfft_valid(deflection * defl_spectrum, shape, padded_shape,
+                                                      kernel_shape, workers)
+        else:
+            acceleration = np.pad(acceleration_fields[start:stop], ((0, 0), (2, 2), (2, 2)))
+            acceleration = rfft_fields(acceleration, shape, workers)
+            virtual_inertia[start:stop] = irfft_valid(acceleration * defl_spectrum, shape, padded_shape,
+                                                      kernel_shape, workers)
+
+    if acceleration_fields is None:
+        # The convolution and the time derivatives commute, so the accelerations are never calculated explicitly
+        time_step_size = 1. / sampling_rate
+        virtual_inertia = np.gradient(np.gradient(virtual_inertia, axis=0) / time_step_size,
+                                      axis=0) / time_step_size
+
+    press = (press + plate.density * plate.thickness * virtual_inertia) / U3
+
+    if shift:
+        for i in range(n_frames):
+            press[i] = ndimage.shift(press[i], (-0.5, -0.5), order=3)
+
+    return press
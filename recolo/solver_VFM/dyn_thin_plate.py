@@ -18,7 +18,8 @@ def calc_pressure_thin_elastic_plate(fields, plate, virtual_fields, shift=False)
     virtual_fields : Virtual fields object
         The virtual fields
     shift : bool
-        Correct for 0.5 pixel shift using bicubic spline interpolation
+        Correct for 0.5 pixel shift using bicubic spline interpolation. The interpolation is avoided by using
+        virtual fields which are centered on the pixels, see Hermite16.
 
     Returns
     -------
@@ -37,6 +38,9 @@ def calc_pressure_thin_elastic_plate(fields, plate, virtual_fields, shift=False)
         # TODO: Make an abstract base class for the virtual fields
         raise IOError("The virtual fields have to be given as an instance of the Hermite16 class")
 
+    if shift and virtual_fields.centered:
+        raise ValueError("The virtual fields are already centered on the pixels and cannot be shifted")
+
     logger.info("Reconstructing pressure")
     A11 = convolve2d(fields.curv_xx, virtual_fields.curv_xx, mode="valid") + convolve2d(fields.curv_yy,
                                                                                         virtual_fields.curv_yy,
@@ -0,0 +1,174 @@
+import os
+import numpy as np
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+import recolo
+from recolo.data_structures.fieldstack import Fields
+from .stack_solver import _pressure_batch, _check_input
+
+
+def _attach_shared_array(name, shape, dtype):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _create_shared_array(shape, dtype):
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _solve_frames(fields, press, start, stop, plate, virtual_fields, shift, batch_size, method):
+    """
+    Reconstruct the pressure for the frames start to stop. The fields are given as a sequence of
+    curv_xx, curv_yy, curv_xy and acceleration arrays with shape (n_frames, n_pts_x, n_pts_y), and the
+    results are written into press.
+    """
+    curv_xx, curv_yy, curv_xy, acceleration = fields
+    for batch_start in range(start, stop, batch_size):
+        batch_stop = min(batch_start + batch_size, stop)
+        frames = slice(batch_start, batch_stop)
+        batch = Fields(None, None, None, curv_xx[frames], curv_yy[frames], curv_xy[frames], acceleration[frames],
+                       None)
+        # Each worker is given a single thread in order not to oversubscribe the cores
+        press[frames] = _pressure_batch(batch, plate, virtual_fields, shift, 1, method)
+
+
+def _solve_batches(batches, press, plate, virtual_fields, shift, method):
+    """
+    Thread pool task. Reconstruct the pressure for batches pulled from a shared FrameBatchIterator until it is
+    exhausted, writing the results into press.
+    """
+    for frames, fields in batches:
+        press[frames] = _pressure_batch(fields, plate, virtual_fields, shift, 1, method)
+
+
+def _solve_frames_in_shared_memory(fields_spec, press_spec, start, stop, plate, virtual_fields, shift, batch_size,
+                                   method):
+    """
+    Process pool task. The fields and the results are found in shared memory blocks described by
+    (name, shape, dtype), such that the fields are not pickled for every task.
+    """
+    fields_shm, fields = _attach_shared_array(*fields_spec)
+    try:
+        press_shm, press = _attach_shared_array(*press_spec)
+        try:
+            _solve_frames(fields, press, start, stop, plate, virtual_fields, shift, batch_size, method)
+        finally:
+            # The arrays have to be released before the blocks can be closed
+            del press
+            press_shm.close()
+    finally:
+        del fields
+        fields_shm.close()
+
+
+def calc_pressure_thin_elastic_plate_parallel(field_stack, plate, virtual_fields, shift=False, n_workers=None,
+                                             executor="process", frames_per_task=None, batch_size=8, method="fft",
+                                             out=None):
+    """
+    Calculate the pressure fields for all frames in a stack of kinematic fields, distributing ranges of frames
+    over a pool of workers. The results are the same as those of calc_pressure_thin_elastic_plate_stack.
+
+    Two executors are available:
+        * "process": The curvature and acceleration fields are copied once into a single shared memory block
+          which is attached by all worker processes. The workers write their results directly into a
+          preallocated shared memory block.
+        * "thread": The workers are threads pulling batches of frames from a shared iterator over the FieldStack,
+          writing their results directly into the preallocated result array.
+
+    Parameters
+    ----------
+    field_stack : FieldStack object
+        The kinematic fields
+    plate : Plate object
+        The plate metrics
+    virtual_fields : Virtual fields object
+        The virtual fields
+    shift : bool
+        Correct for 0.5 pixel shift using bicubic spline interpolation
+    n_workers : int
+        The number of workers. Defaults to the number of cores.
+    executor : str
+        The type of workers, either "process" or "thread"
+    frames_per_task : int
+        The number of frames which are given to a worker process at a time.
+        Defaults to splitting the frames into four tasks per worker.
+    batch_size : int
+        The number of frames which are processed at once by a worker
+    method : str
+        The convolution method, either "fft" or "separable"
+    out : ndarray
+        A preallocated array with shape (n_frames, n_pts_x, n_pts_y) in which the results are stored
+
+    Returns
+    -------
+    press : ndarray
+        The reconstructed pressure fields with shape (n_frames, n_pts_x, n_pts_y)
+    """
+    logger = logging.getLogger(__name__)
+    _check_input(field_stack, virtual_fields, batch_size, method, shift)
+
+    if not isinstance(plate, recolo.data_structures.plate.Plate):
+        raise IOError("The plate metrics have to be given as an instance of the Plate class")
+
+    if executor not in ("process", "thread"):
+        raise ValueError("The executor has to be either \"process\" or \"thread\"")
+
+    n_workers = os.cpu_count() if n_workers is None else n_workers
+    if type(n_workers) != int or n_workers < 1:
+        raise ValueError("The number of workers has to be an integer larger or equal to 1")
+
+    n_frames, n_pts_x, n_pts_y = field_stack.shape()
+    kernel_shape = np.shape(virtual_fields.deflection)
+    press_shape = (n_frames, n_pts_x - kernel_shape[0] + 1, n_pts_y - kernel_shape[1] + 1)
+
+    if out is None:
+        out = np.zeros(press_shape)
+    elif np.shape(out) != press_shape:
+        raise ValueError("The output array has to have the shape (%i,%i,%i)" % press_shape)
+
+    if executor == "thread":
+        # The workers pull disjoint batches of frames from a shared iterator
+        batches = field_stack.iter_batches(batch_size)
+        logger.info("Reconstructing pressure for %i frames in %i batches using %i thread workers" % (
+            n_frames, len(batches), n_workers))
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(_solve_batches, batches, out, plate, virtual_fields, shift, method) for _ in
+                       range(n_workers)]
+            for future in futures:
+                future.result()
+        return out
+
+    if frames_per_task is None:
+        frames_per_task = max(int(np.ceil(n_frames / (4. * n_workers))), 1)
+    tasks = [(start, min(start + frames_per_task, n_frames)) for start in range(0, n_frames, frames_per_task)]
+    logger.info("Reconstructing pressure for %i frames in %i tasks using %i process workers" % (
+        n_frames, len(tasks), n_workers))
+
+    # Every block is unlinked even if the allocation of the next block fails
+    fields_shm, fields = _create_shared_array((4, n_frames, n_pts_x, n_pts_y), np.float64)
+    try:
+        for frames, batch in field_stack.iter_batches(batch_size):
+            fields[:, frames] = (batch.curv_xx, batch.curv_yy, batch.curv_xy, batch.acceleration)
+
+        press_shm, press = _create_shared_array(press_shape, np.float64)
+        try:
+            fields_spec = (fields_shm.name, fields.shape, fields.dtype)
+            press_spec = (press_shm.name, press.shape, press.dtype)
+            with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                futures = [pool.submit(_solve_frames_in_shared_memory, fields_spec, press_spec, start, stop, plate,
+                                       virtual_fields, shift, batch_size, method) for start, stop in tasks]
+                for future in futures:
+                    future.result()
+            out[:] = press
+        finally:
+            del press
+            press_shm.close()
+            press_shm.unlink()
+    finally:
+        del fields
+        fields_shm.close()
+        fields_shm.unlink()
+
+    return out
@@ -0,0 +1,195 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import fftconvolve
+import logging
+import recolo
+
+
+def _weight_kernels(plate, virtual_fields):
+    """
+    The kernels which are multiplied with curv_xx, curv_yy, curv_xy and the acceleration within a window and
+    summed to give the pressure. The kernels are flipped such that the sum equals the convolution.
+    """
+    U3 = np.sum(virtual_fields.deflection)
+    stiff_11, stiff_12 = plate.bend_stiff_11, plate.bend_stiff_12
+
+    weight_curv_xx = stiff_11 * virtual_fields.curv_xx + stiff_12 * virtual_fields.curv_yy
+    weight_curv_yy = stiff_11 * virtual_fields.curv_yy + stiff_12 * virtual_fields.curv_xx
+    weight_curv_xy = 2. * (stiff_11 - stiff_12) * virtual_fields.curv_xy
+    weight_acceleration = plate.density * plate.thickness * virtual_fields.deflection
+
+    return [weight[::-1, ::-1] / U3 for weight in
+            (weight_curv_xx, weight_curv_yy, weight_curv_xy, weight_acceleration)]
+
+
+def calc_pressure_thin_elastic_plate_probes(field_stack, plate, virtual_fields, points=None, stride=None,
+                                           batch_size=64):
+    """
+    Calculate the pressure at a set of probe points or on a strided grid for all frames in a stack of kinematic
+    fields. The virtual fields method is only evaluated at the requested points, such that the cost scales with
+    the number of points and not the number of pixels.
+
+    The coordinates of the points are given in the coordinates of the pressure fields returned by
+    calc_pressure_thin_elastic_plate, such that:
+        * The pressure at points [(i, j)] equals press[:, i, j]
+        * The pressure with stride s equals press[:, ::s, ::s]
+
+    Parameters
+    ----------
+    field_stack : FieldStack object
+        The kinematic fields
+    plate : Plate object
+        The plate metrics
+    virtual_fields : Virtual fields object
+        The virtual fields
+    points : list
+        A list of (row, column) coordinates of the probe points. Cannot be combined with stride.
+    stride : int
+        The stride of the grid of points. Cannot be combined with points.
+    batch_size : int
+        The number of frames which are processed at once
+
+    Returns
+    -------
+    press : ndarray
+        The reconstructed pressure with shape (n_frames, n_points) if points are given and
+        (n_frames, n_pts_x, n_pts_y) if a stride is given.
+    """
+    logger = logging.getLogger(__name__)
+    if not isinstance(field_stack, recolo.FieldStack):
+        raise IOError("The kinematic fields have to be given as an instance of the FieldStack class")
+
+    if not isinstance(plate, recolo.data_structures.plate.Plate):
+        raise IOError("The plate metrics have to be given as an instance of the Plate class")
+
+    if not isinstance(virtual_fields, recolo.virtual_fields.Hermite16):
+        raise IOError("The virtual fields have to be given as an instance of the Hermite16 class")
+
+    if (points is None) == (stride is None):
+        raise ValueError("Either the probe points or the stride has to be given")
+
+    if type(batch_size) != int or batch_size < 1:
+        raise ValueError("The batch size has to be an integer larger or equal to 1")
+
+    n_frames, n_pts_x, n_pts_y = field_stack.shape()
+    win_x, win_y = np.shape(virtual_fields.deflection)
+    out_x, out_y = n_pts_x - win_x + 1, n_pts_y - win_y + 1
+
+    if points is not None:
+        points = np.array(points, dtype=int).reshape((-1, 2))
+        rows, cols = points[:, 0], points[:, 1]
+        if np.any(rows < 0) or np.any(rows >= out_x) or np.any(cols < 0) or np.any(cols >= out_y):
+            raise ValueError("The probe points have to be within the pressure fields of shape (%i,%i)" % (
+                out_x, out_y))
+        press = np.zeros((n_frames, len(points)))
+    else:
+        if type(stride) != int or stride < 1:
+            raise ValueError("The stride has to be an integer larger or equal to 1")
+        press = np.zeros((n_frames, len(range(0, out_x, stride)), len(range(0, out_y, stride))))
+
+    weights = _weight_kernels(plate, virtual_fields)
+
+    for frames, fields in field_stack.iter_batches(batch_size):
+        logger.info("Reconstructing pressure at probes for frame %i to %i" % (frames.start, frames.stop - 1))
+
+        for field, weight in zip((fields.curv_xx, fields.curv_yy, fields.curv_xy, fields.acceleration), weights):
+            windows = sliding_window_view(field, (win_x, win_y), axis=(1, 2))
+            if points is not None:
+                press[frames] += np.einsum("tpab,ab->tp", windows[:, rows, cols], weight)
+            else:
+                press[frames] += np.einsum("tijab,ab->tij", windows[:, ::stride, ::stride], weight)
+
+    return press
+
+
+def _region_weights(region, plate, virtual_fields, n_pts_x, n_pts_y):
+    """
+    Collapse the virtual fields and a region of the pressure field into weight maps with the same shape as the
+    kinematic fields, such that the sum of the pressure within the region equals the sum of the products of the
+    kinematic fields and the weight maps.
+    """
+    win_x, win_y = np.shape(virtual_fields.deflection)
+    out_shape = (n_pts_x - win_x + 1, n_pts_y - win_y + 1)
+
+    if isinstance(region, tuple) and len(region) == 2 and all(isinstance(sl, slice) for sl in region):
+        # A rectangle is separable, such that the weights are sums of outer products of 1D box convolutions
+        box_x = np.zeros(out_shape[0])
+        box_y = np.zeros(out_shape[1])
+        box_x[region[0]] = 1.
+        box_y[region[1]] = 1.
+
+        U3 = np.sum(virtual_fields.deflection)
+        stiff_11, stiff_12 = plate.bend_stiff_11, plate.bend_stiff_12
+        factors = virtual_fields.factors
+        terms = [[(stiff_11, factors.curv_xx), (stiff_12, factors.curv_yy)],
+                 [(stiff_11, factors.curv_yy), (stiff_12, factors.curv_xx)],
+                 [(2. * (stiff_11 - stiff_12), factors.curv_xy)],
+                 [(plate.density * plate.thickness, factors.deflection)]]
+        return [sum(coeff * np.outer(np.convolve(box_x, factor_x[::-1]), np.convolve(box_y, factor_y[::-1]))
+                    for coeff, (factor_x, factor_y) in term) / U3 for term in terms]
+
+    mask = np.asarray(region, dtype=float)
+    if mask.shape != out_shape:
+        raise ValueError("The region mask has to have the same shape as the pressure fields (%i,%i)" % out_shape)
+    return [fftconvolve(mask, weight, mode="full") for weight in _weight_kernels(plate, virtual_fields)]
+
+
+def calc_force_thin_elastic_plate_regions(field_stack, plate, virtual_fields, regions, pixel_size, batch_size=64):
+    """
+    Calculate the force history acting on a set of regions of the plate for all frames in a stack of kinematic
+    fields, without determining the pressure fields.
+
+    As the virtual fields method is linear, the virtual fields and the region are collapsed into weight maps
+    once, and the force is obtained by a single weighted sum of the kinematic fields for every frame.
+
+    The regions are given in the coordinates of the pressure fields returned by calc_pressure_thin_elastic_plate,
+    either as:
+        * A rectangle given by a tuple of two slices, such that np.s_[20:50, 20:50] gives the same force as
+          np.sum(press[:, 20:50, 20:50], axis=(1, 2)) * pixel_size ** 2.
+        * A boolean mask with the same shape as the pressure fields.
+
+    Parameters
+    ----------
+    field_stack : FieldStack object
+        The kinematic fields
+    plate : Plate object
+        The plate metrics
+    virtual_fields : Virtual fields object
+        The virtual fields
+    regions : list
+        A list of regions given as rectangles or masks
+    pixel_size : float
+        The physical pixel size of the kinematic fields
+    batch_size : int
+        The number of frames which are processed at once
+
+    Returns
+    -------
+    force : ndarray
+        The force acting on the regions with shape (n_frames, n_regions)
+    """
+    logger = logging.getLogger(__name__)
+    if not isinstance(field_stack, recolo.FieldStack):
+        raise IOError("The kinematic fields have to be given as an instance of the FieldStack class")
+
+    if not isinstance(plate, recolo.data_structures.plate.Plate):
+        raise IOError("The plate metrics have to be given as an instance of the Plate class")
+
+    if not isinstance(virtual_fields, recolo.virtual_fields.Hermite16):
+        raise IOError("The virtual fields have to be given as an instance of the Hermite16 class")
+
+    if type(batch_size) != int or batch_size < 1:
+        raise ValueError("The batch size has to be an integer larger or equal to 1")
+
+    n_frames, n_pts_x, n_pts_y = field_stack.shape()
+    region_weights = [_region_weights(region, plate, virtual_fields, n_pts_x, n_pts_y) for region in regions]
+    # Stack the weights as [component,region,x,y]
+    weights = np.array(region_weights).transpose((1, 0, 2, 3)) * pixel_size ** 2.
+
+    force = np.zeros((n_frames, len(regions)))
+    for frames, fields in field_stack.iter_batches(batch_size):
+        logger.info("Calculating forces for frame %i to %i" % (frames.start, frames.stop - 1))
+        for field, weight in zip((fields.curv_xx, fields.curv_yy, fields.curv_xy, fields.acceleration), weights):
+            force[frames] += np.einsum("txy,rxy->tr", field, weight)
+
+    return force
@@ -0,0 +1,292 @@
+import numpy as np
+from scipy import ndimage
+from collections import namedtuple
+import logging
+import recolo
+from recolo.math_tools.fft_convolution import fft_shape, rfft_fields, irfft_valid
+from recolo.math_tools.separable_convolution import separable_convolve_valid
+
+
+PressureBasis = namedtuple("PressureBasis", ["A11", "A12", "inertia", "U3"])
+
+
+def _field_spectra(fields, shape, workers):
+    return [rfft_fields(field, shape, workers) for field in
+            (fields.curv_xx, fields.curv_yy, fields.curv_xy, fields.acceleration)]
+
+
+def _basis_fft(field_spectra, vf_spectra):
+    curv_xx, curv_yy, curv_xy, acceleration = field_spectra
+    vf_curv_xx, vf_curv_yy, vf_curv_xy, vf_deflection = vf_spectra
+
+    A11 = curv_xx * vf_curv_xx + curv_yy * vf_curv_yy + 2. * curv_xy * vf_curv_xy
+    A12 = curv_xx * vf_curv_yy + curv_yy * vf_curv_xx - 2. * curv_xy * vf_curv_xy
+    inertia = acceleration * vf_deflection
+    return A11, A12, inertia
+
+
+def _basis_separable(fields, vf_factors):
+    def conv(field, factors):
+        return separable_convolve_valid(field, *factors)
+
+    A11 = conv(fields.curv_xx, vf_factors.curv_xx) + conv(fields.curv_yy, vf_factors.curv_yy) + 2. * conv(
+        fields.curv_xy, vf_factors.curv_xy)
+    A12 = conv(fields.curv_xx, vf_factors.curv_yy) + conv(fields.curv_yy, vf_factors.curv_xx) - 2. * conv(
+        fields.curv_xy, vf_factors.curv_xy)
+    inertia = conv(fields.acceleration, vf_factors.deflection)
+    return A11, A12, inertia
+
+
+def _combine_basis(A11, A12, inertia, U3, plate):
+    # Works on both the basis maps and their spectra as the virtual fields method is linear
+    return (A11 * plate.bend_stiff_11 + A12 * plate.bend_stiff_12 + plate.density * plate.thickness * inertia) / U3
+
+
+def _check_input(field_stack, virtual_fields, batch_size, method, shift=False):
+    if not isinstance(field_stack, recolo.FieldStack):
+        raise IOError("The kinematic fields have to be given as an instance of the FieldStack class")
+
+    if not isinstance(virtual_fields, recolo.virtual_fields.Hermite16):
+        raise IOError("The virtual fields have to be given as an instance of the Hermite16 class")
+
+    if type(batch_size) != int or batch_size < 1:
+        raise ValueError("The batch size has to be an integer larger or equal to 1")
+
+    if method not in ("fft", "separable"):
+        raise ValueError("The method has to be either \"fft\" or \"separable\"")
+
+    if shift and virtual_fields.centered:
+        raise ValueError("The virtual fields are already centered on the pixels and cannot be shifted")
+
+
+def _pressure_batch(fields, plate, virtual_fields, shift, workers, method):
+    """
+    Calculate the pressure fields for a batch of kinematic fields given as a Fields object with fields of
+    shape (n_frames, n_pts_x, n_pts_y). Only the curvatures and the accelerations are used.
+    """
+    field_shape = np.shape(fields.curv_xx)[-2:]
+    kernel_shape = np.shape(virtual_fields.deflection)
+    U3 = np.sum(virtual_fields.deflection)
+
+    if method == "fft":
+        shape = fft_shape(field_shape, kernel_shape)
+        field_spectra = _field_spectra(fields, shape, workers)
+        press_spectra = _combine_basis(*_basis_fft(field_spectra, virtual_fields.spectra(shape)), U3, plate)
+        press = irfft_valid(press_spectra, shape, field_shape, kernel_shape, workers)
+    else:
+        press = _combine_basis(*_basis_separable(fields, virtual_fields.factors), U3, plate)
+
+    if shift:
+        for i in range(len(press)):
+            press[i] = ndimage.shift(press[i], (-0.5, -0.5), order=3)
+
+    return press
+
+
+def calc_pressure_thin_elastic_plate_stack(field_stack, plate, virtual_fields, shift=False, batch_size=8,
+                                          workers=None, method="fft"):
+    """
+    Calculate the pressure fields for all frames in a stack of kinematic fields.
+    This gives the same results as calling calc_pressure_thin_elastic_plate for every frame, but several frames
+    are processed at once using one of the following methods:
+        * "fft": The convolutions are performed as real-to-complex FFTs over the spatial axes. As the virtual
+          fields method is linear, the contributions are summed in the frequency domain such that only a single
+          inverse transform is needed per frame.
+        * "separable": The virtual fields are factorized into one-dimensional profiles and the convolutions are
+          performed as row and column passes, with a cost which scales with the window size and not its area.
+
+    Parameters
+    ----------
+    field_stack : FieldStack object
+        The kinematic fields
+    plate : Plate object
+        The plate metrics
+    virtual_fields : Virtual fields object
+        The virtual fields
+    shift : bool
+        Correct for 0.5 pixel shift using bicubic spline interpolation. The interpolation is avoided by using
+        virtual fields which are centered on the pixels, see Hermite16.
+    batch_size : int
+        The number of frames which are processed at once
+    workers : int
+        The number of threads used by scipy.fft
+    method : str
+        The convolution method, either "fft" or "separable"
+
+    Returns
+    -------
+    press : ndarray
+        The reconstructed pressure fields with shape (n_frames, n_pts_x, n_pts_y)
+    """
+    logger = logging.getLogger(__name__)
+    _check_input(field_stack, virtual_fields, batch_size, method, shift)
+
+    if not isinstance(plate, recolo.data_structures.plate.Plate):
+        raise IOError("The plate metrics have to be given as an instance of the Plate class")
+
+    n_frames, n_pts_x, n_pts_y = field_stack.shape()
+    kernel_shape = np.shape(virtual_fields.deflection)
+    press = np.zeros((n_frames, n_pts_x - kernel_shape[0] + 1, n_pts_y - kernel_shape[1] + 1))
+
+    for frames, fields in field_stack.iter_batches(batch_size):
+        logger.info("Reconstructing pressure for frame %i to %i" % (frames.start, frames.stop - 1))
+        press[frames] = _pressure_batch(fields, plate, virtual_fields, shift, workers, method)
+
+    return press
+
+
+def calc_pressure_basis_thin_elastic_plate_stack(field_stack, virtual_fields, batch_size=8, workers=None,
+                                                method="fft"):
+    """
+    Calculate the material independent basis maps of the virtual fields method for all frames in a stack of
+    kinematic fields. The pressure fields for any plate are then given by the linear combination:
+        press = (A11 * bend_stiff_11 + A12 * bend_stiff_12 + density * thickness * inertia) / U3
+    which is implemented in pressure_from_basis. This allows for cheap material sensitivity studies and
+    identification of the material parameters, as the convolutions are only performed once.
+
+    Parameters
+    ----------
+    field_stack : FieldStack object
+        The kinematic fields
+    virtual_fields : Virtual fields object
+        The virtual fields
+    batch_size : int
+        The number of frames which are processed at once
+    workers : int
+        The number of threads used by scipy.fft
+    method : str
+        The convolution method, either "fft" or "separable"
+
+    Returns
+    -------
+    basis : PressureBasis
+        The basis maps A11, A12 and inertia with shape (n_frames, n_pts_x, n_pts_y), and the
+        integral of the virtual deflection field U3.
+    """
+    logger = logging.getLogger(__name__)
+    _check_input(field_stack, virtual_fields, batch_size, method)
+
+    n_frames, n_pts_x, n_pts_y = field_stack.shape()
+    field_shape = (n_pts_x, n_pts_y)
+    kernel_shape = np.shape(virtual_fields.deflection)
+    shape = fft_shape(field_shape, kernel_shape)
+
+    if method == "fft":
+        vf_spectra = virtual_fields.spectra(shape)
+
+    basis = np.zeros((3, n_frames, n_pts_x - kernel_shape[0] + 1, n_pts_y - kernel_shape[1] + 1))
+
+    for frames, fields in field_stack.iter_batches(batch_size):
+        logger.info("Calculating basis maps for frame %i to %i" % (frames.start, frames.stop - 1))
+
+        if method == "fft":
+            for i, spectra in enumerate(_basis_fft(_field_spectra(fields, shape, workers), vf_spectra)):
+                basis[i, frames] = irfft_valid(spectra, shape, field_shape, kernel_shape, workers)
+        else:
+            basis[:, frames] = _basis_separable(fields, virtual_fields.factors)
+
+    return PressureBasis(basis[0], basis[1], basis[2], np.sum(virtual_fields.deflection))
+
+
+def pressure_from_basis(basis, plate, shift=False):
+    """
+    Calculate the pressure fields for a given plate from the basis maps of the virtual fields method.
+
+    Parameters
+    ----------
+    basis : PressureBasis
+        The basis maps, see calc_pressure_basis_thin_elastic_plate_stack
+    plate : Plate object
+        The plate metrics
+    shift : bool
+        Correct for 0.5 pixel shift using bicubic spline interpolation
+
+    Returns
+    -------
+    press : ndarray
+        The reconstructed pressure fields with shape (n_frames, n_pts_x, n_pts_y)
+    """
+    if not isinstance(basis, PressureBasis):
+        raise IOError("The basis maps have to be given as an instance of the PressureBasis class")
+
+    if not isinstance(plate, recolo.data_structures.plate.Plate):
+        raise IOError("The plate metrics have to be given as an instance of the Plate class")
+
+    press = _combine_basis(basis.A11, basis.A12, basis.inertia, basis.U3, plate)
+
+    if shift:
+        for i in range(len(press)):
+            press[i] = ndimage.shift(press[i], (-0.5, -0.5), order=3)
+
+    return press
+
+
+def calc_pressure_thin_elastic_plate_window_sweep(field_stack, plate, win_sizes, pixel_size, shift=False,
+                                                  batch_size=8, workers=None, centered=False):
+    """
+    Calculate the pressure fields for all frames in a stack of kinematic fields using Hermite16 virtual fields
+    with several window sizes.
+    The kinematic fields are only transformed once, using a transform shape large enough for the largest window,
+    and are then multiplied with the cached spectra of every window. The results are the same as calling
+    calc_pressure_thin_elastic_plate_stack once for every window size.
+
+    Parameters
+    ----------
+    field_stack : FieldStack object
+        The kinematic fields
+    plate : Plate object
+        The plate metrics
+    win_sizes : list
+        The window sizes of the virtual fields in pixels
+    pixel_size : float
+        The physical pixel size
+    shift : bool
+        Correct for 0.5 pixel shift using bicubic spline interpolation
+    batch_size : int
+        The number of frames which are processed at once
+    workers : int
+        The number of threads used by scipy.fft
+    centered : bool
+        Use virtual fields which are centered on the pixels, see Hermite16
+
+    Returns
+    -------
+    presses : list
+        The reconstructed pressure fields with shape (n_frames, n_pts_x, n_pts_y) for every window size
+    """
+    logger = logging.getLogger(__name__)
+    virtual_fields = [recolo.virtual_fields.Hermite16(win_size, pixel_size, centered) for win_size in win_sizes]
+    if len(virtual_fields) == 0:
+        raise ValueError("At least one window size has to be given")
+
+    for virtual_field in virtual_fields:
+        _check_input(field_stack, virtual_field, batch_size, "fft", shift)
+
+    if not isinstance(plate, recolo.data_structures.plate.Plate):
+        raise IOError("The plate metrics have to be given as an instance of the Plate class")
+
+    n_frames, n_pts_x, n_pts_y = field_stack.shape()
+    field_shape = (n_pts_x, n_pts_y)
+    kernel_shapes = [np.shape(virtual_field.deflection) for virtual_field in virtual_fields]
+    shape = fft_shape(field_shape, np.max(kernel_shapes, axis=0))
+    vf_spectra = [virtual_field.spectra(shape) for virtual_field in virtual_fields]
+    U3s = [np.sum(virtual_field.deflection) for virtual_field in virtual_fields]
+
+    presses = [np.zeros((n_frames, n_pts_x - kernel_shape[0] + 1, n_pts_y - kernel_shape[1] + 1)) for kernel_shape
+               in kernel_shapes]
+
+    for frames, fields in field_stack.iter_batches(batch_size):
+        logger.info("Reconstructing pressure for %i window sizes for frame %i to %i" % (
+            len(win_sizes), frames.start, frames.stop - 1))
+        field_spectra = _field_spectra(fields, shape, workers)
+
+        for press, spectra, U3, kernel_shape in zip(presses, vf_spectra, U3s, kernel_shapes):
+            press_spectra = _combine_basis(*_basis_fft(field_spectra, spectra), U3, plate)
+            press[frames] = irfft_valid(press_spectra, shape, field_shape, kernel_shape, workers)
+
+    if shift:
+        for press in presses:
+            for i in range(n_frames):
+                press[i] = ndimage.shift(press[i], (-0.5, -0.5), order=3)
+
+    return presses
@@ -0,0 +1,34 @@
+import numpy as np
+import recolo
+
+
+def harmonic_deflection_fields(n_frames, n_pts_x, n_pts_y):
+    """
+    Smooth deflection fields with shape (n_frames, n_pts_x, n_pts_y), growing quadratically in time such that
+    the accelerations are non-zero.
+    """
+    xs, ys = np.meshgrid(np.linspace(0, 1, n_pts_y), np.linspace(0, 1, n_pts_x))
+    time_ramp = 1.e-3 * np.arange(n_frames) ** 2.
+    deflection_field = np.sin(np.pi * xs) * np.sin(2. * np.pi * ys) + 0.3 * np.cos(3. * np.pi * xs * ys)
+    return deflection_field[np.newaxis, :, :] * (1. + time_ramp[:, np.newaxis, np.newaxis])
+
+
+class FieldAssertions(object):
+    """
+    Comparisons of kinematic fields and pressure fields for TestCases, using the relative tolerance self.tol.
+    """
+
+    def assert_same_fields(self, fields, correct_fields):
+        for name, field, correct_field in zip(recolo.Fields._fields, fields, correct_fields):
+            if np.shape(field) != np.shape(correct_field):
+                self.fail("The %s fields have the shape %s and not %s" % (name, np.shape(field),
+                                                                          np.shape(correct_field)))
+            if np.max(np.abs(field - correct_field)) > self.tol * np.max(np.abs(correct_field)):
+                self.fail("The %s fields differ" % name)
+
+    def assert_same_pressure(self, press, correct_press):
+        if press.shape != correct_press.shape:
+            self.fail("The pressure fields have the shape %s and not %s" % (press.shape, correct_press.shape))
+        rel_error = np.max(np.abs(press - correct_press)) / np.max(np.abs(correct_press))
+        if rel_error > self.tol:
+            self.fail("The pressure fields differ with a relative error of %f" % rel_error)
@@ -1,5 +1,8 @@
 from unittest import TestCase
-from recolo.data_structures import load_abaqus_rpts
+from recolo.data_structures import load_abaqus_rpts, read_abaqus_rpt
+import numpy as np
+import tempfile
+import shutil
 import pathlib
 import os
 
@@ -22,3 +25,170 @@ class TestReadAbaqusField(TestCase):
         if shape_deflection[0] != shape_time[0]:
             self.fail(("The time axis is not of the same length (%i) as the number of frames (%i)" % (
             shape_deflection[0], shape_time[0])))
+
+    def test_parallel_same_as_sequential(self):
+        abaqus_fields = load_abaqus_rpts(os.path.join(cwd, "ExampleAbaqusRPT/"), workers=2)
+        for name, field, correct_field in zip(abaqus_fields._fields, abaqus_fields, self.abaqus_fields):
+            if not np.array_equal(field, correct_field):
+                self.fail("The %s differ when loading the files in parallel" % name)
+
+    def test_lazy_same_as_eager(self):
+        abaqus_fields = load_abaqus_rpts(os.path.join(cwd, "ExampleAbaqusRPT/"), lazy=True, cache_size=1)
+        for name, field, correct_field in zip(abaqus_fields._fields, abaqus_fields, self.abaqus_fields):
+            if not np.array_equal(np.asarray(field), correct_field):
+                self.fail("The %s differ when loading the files lazily" % name)
+
+        self.assertEqual(abaqus_fields.disp_fields.shape, self.abaqus_fields.disp_fields.shape)
+        np.testing.assert_array_equal(abaqus_fields.accel_fields[-1], self.abaqus_fields.accel_fields[-1])
+        np.testing.assert_array_equal(abaqus_fields.slope_x_fields[:, 5:-5, 5:-5],
+                                      self.abaqus_fields.slope_x_fields[:, 5:-5, 5:-5])
+
+    def test_iter_frames(self):
+        for abaqus_fields in [self.abaqus_fields, load_abaqus_rpts(os.path.join(cwd, "ExampleAbaqusRPT/"), lazy=True)]:
+            frames = list(abaqus_fields.iter_frames())
+            self.assertEqual(len(frames), len(self.abaqus_fields.times))
+            for frame_id, frame in enumerate(frames):
+                self.assertEqual(frame.time, self.abaqus_fields.times[frame_id])
+                np.testing.assert_array_equal(frame.disp_field, self.abaqus_fields.disp_fields[frame_id])
+
+    def test_use_only_img_ids(self):
+        abaqus_fields = load_abaqus_rpts(os.path.join(cwd, "ExampleAbaqusRPT/"), use_only_img_ids=[1, 0, 5])
+        np.testing.assert_array_equal(abaqus_fields.times, self.abaqus_fields.times)
+
+
+class TestReadAbaqusReport(TestCase):
+    def setUp(self):
+        self.path_to_rpt = os.path.join(cwd, "ExampleAbaqusRPT", "fields_frame1.rpt")
+
+    def test_same_as_genfromtxt(self):
+        report = read_abaqus_rpt(self.path_to_rpt)
+        field_data = np.genfromtxt(self.path_to_rpt, dtype=float, skip_header=19)
+
+        self.assertEqual(report.time, 1.e-5)
+        np.testing.assert_array_equal(report.node_labels, field_data[:, 0])
+        for i, name in enumerate(["COORD.COOR1", "COORD.COOR2", "U.U3", "A.A3", "UR.UR1", "UR.UR2"], start=1):
+            np.testing.assert_array_equal(report.columns[name], field_data[:, i])
+
+    def test_columns_found_by_name(self):
+        # Reports with the columns in another order and a summary after the table
+        with open(self.path_to_rpt, "r") as rpt_file:
+            lines = rpt_file.read().rstrip().split("\n")
+        header_end = 19
+        swapped = [" ".join(np.array(line.split())[[0, 1, 2, 4, 3, 5, 6]]) for line in lines[16:18]]
+        table = [" ".join(np.array(line.split())[[0, 1, 2, 4, 3, 5, 6]]) for line in lines[header_end:]]
+        summary = ["", "  Minimum  0. 0. 0. 0. 0. 0."]
+        with tempfile.TemporaryDirectory() as folder:
+            path_to_rpt = os.path.join(folder, "swapped.rpt")
+            with open(path_to_rpt, "w") as rpt_file:
+                rpt_file.write("\n".join(lines[:16] + swapped + lines[18:header_end] + table + summary))
+            report = read_abaqus_rpt(path_to_rpt)
+
+        correct_report = read_abaqus_rpt(self.path_to_rpt)
+        for name in correct_report.columns:
+            np.testing.assert_array_equal(report.columns[name], correct_report.columns[name])
+
+
+class TestAbaqusCache(TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for file_name in os.listdir(os.path.join(cwd, "ExampleAbaqusRPT")):
+            shutil.copy(os.path.join(cwd, "ExampleAbaqusRPT", file_name), self.folder)
+        self.abaqus_fields = load_abaqus_rpts(self.folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def assert_same_data(self, abaqus_fields):
+        for name, field, correct_field in zip(abaqus_fields._fields, abaqus_fields, self.abaqus_fields):
+            if not np.array_equal(field, correct_field):
+                self.fail("The cached %s differ" % name)
+
+    def test_cached_same_as_parsed(self):
+        self.assert_same_data(load_abaqus_rpts(self.folder, cache=True))
+        cached_fields = load_abaqus_rpts(self.folder, cache=True)
+        self.assertIsInstance(cached_fields.disp_fields, np.memmap)
+        self.assert_same_data(cached_fields)
+
+    def test_invalidated_by_changed_files(self):
+        load_abaqus_rpts(self.folder, cache=True)
+        path_to_rpt = os.path.join(self.folder, "fields_frame1.rpt")
+        with open(path_to_rpt, "r") as rpt_file:
+            text = rpt_file.read()
+        with open(path_to_rpt, "w") as rpt_file:
+            rpt_file.write(text.replace("Step Time =   1.0000E-05", "Step Time =   2.0000E-05"))
+
+        abaqus_fields = load_abaqus_rpts(self.folder, cache=True)
+        self.assertNotIsInstance(abaqus_fields.disp_fields, np.memmap)
+        self.assertEqual(abaqus_fields.times[1], 2.e-5)
+
+    def test_single_cache_kept(self):
+        load_abaqus_rpts(self.folder, cache=True)
+        for mtime in [1.e9, 2.e9]:
+            os.utime(os.path.join(self.folder, "fields_frame0.rpt"), (mtime, mtime))
+            load_abaqus_rpts(self.folder, cache=True)
+        self.assertEqual(len(os.listdir(os.path.join(self.folder, ".recolo_cache"))), 1)
+        self.assertIsInstance(load_abaqus_rpts(self.folder, cache=True).disp_fields, np.memmap)
+
+    def test_damaged_cache_is_parsed_again(self):
+        load_abaqus_rpts(self.folder, cache=True)
+        cache_folder = os.path.join(self.folder, ".recolo_cache")
+        cache_path = os.path.join(cache_folder, os.listdir(cache_folder)[0])
+        with open(os.path.join(cache_path, "accel_fields.npy"), "r+b") as npy_file:
+            npy_file.truncate(200)
+        os.remove(os.path.join(cache_path, "slope_x_fields.npy"))
+
+        abaqus_fields = load_abaqus_rpts(self.folder, cache=True)
+        self.assertNotIsInstance(abaqus_fields.disp_fields, np.memmap)
+        self.assert_same_data(abaqus_fields)
+        self.assert_same_data(load_abaqus_rpts(self.folder, cache=True))
+        self.assertIsInstance(load_abaqus_rpts(self.folder, cache=True).disp_fields, np.memmap)
+
+
+class TestRectangularAbaqusGrid(TestCase):
+    def setUp(self):
+        with open(os.path.join(cwd, "ExampleAbaqusRPT", "fields_frame0.rpt"), "r") as rpt_file:
+            self.header = rpt_file.read().split("\n")[:19]
+        self.folder = tempfile.mkdtemp()
+
+    def write_reports(self, coord_noise=None):
+        # A rectangular grid with 4 points along COOR2 and 6 points along COOR1 with the nodes in random order
+        coords_y, coords_x = np.meshgrid(np.arange(4) * 5., np.arange(6) * 5., indexing="ij")
+        order = np.random.default_rng(0).permutation(coords_x.size)
+        node_coords_x, node_coords_y = coords_x.ravel()[order], coords_y.ravel()[order]
+        report_coords_x, report_coords_y = node_coords_x.copy(), node_coords_y.copy()
+        if coord_noise is not None:
+            report_coords_x += coord_noise * np.random.default_rng(1).standard_normal(len(order))
+            report_coords_y += coord_noise * np.random.default_rng(2).standard_normal(len(order))
+
+        self.correct_disp_fields = []
+        for frame_id in range(3):
+            disp = (frame_id + 1.) * (node_coords_x + 10. * node_coords_y)
+            table = ["%i %f %f %f %f %f %f" % (i + 1, x, y, u, 2. * u, 0., 0.) for i, (x, y, u) in
+                     enumerate(zip(report_coords_x, report_coords_y, disp))]
+            header = [line.replace("0.0", "%f" % (frame_id * 1.e-5)) if "Step Time" in line else line for line in
+                      self.header]
+            with open(os.path.join(self.folder, "frame%i.rpt" % frame_id), "w") as rpt_file:
+                rpt_file.write("\n".join(header + table) + "\n\n")
+            self.correct_disp_fields.append(-(frame_id + 1.) * (coords_x + 10. * coords_y) * 1e-3)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_fields_on_grid(self):
+        self.write_reports()
+        for kwargs in [{}, {"workers": 2}, {"lazy": True}]:
+            abaqus_fields = load_abaqus_rpts(self.folder, **kwargs)
+            self.assertEqual(abaqus_fields.disp_fields.shape, (3, 4, 6))
+            np.testing.assert_allclose(np.asarray(abaqus_fields.disp_fields), self.correct_disp_fields, atol=1e-12)
+            np.testing.assert_allclose(np.asarray(abaqus_fields.accel_fields), 2. * np.array(self.correct_disp_fields),
+                                       atol=1e-12)
+            self.assertAlmostEqual(abaqus_fields.pixel_size_x, 15.e-3 / 4.)
+            self.assertAlmostEqual(abaqus_fields.pixel_size_y, 25.e-3 / 6.)
+            self.assertAlmostEqual(abaqus_fields.sampling_rate, 1.e5)
+
+    def test_jittered_coordinates(self):
+        # Rounding in the reports gives coordinates such as 4.99999 instead of 5.
+        self.write_reports(coord_noise=1.e-5)
+        abaqus_fields = load_abaqus_rpts(self.folder)
+        self.assertEqual(abaqus_fields.disp_fields.shape, (3, 4, 6))
+        np.testing.assert_allclose(abaqus_fields.disp_fields, self.correct_disp_fields, atol=1e-12)
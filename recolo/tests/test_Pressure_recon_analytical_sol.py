@@ -55,6 +55,42 @@ class Test_FullStaticReconstruction(TestCase):
         if error/press >tol:
             self.fail("Reconstruction had a normalized RMS error of %f"%(error/press))
 
+    def test_analytical_sinusoidal_centered_virtual_fields(self):
+        # Tolerance set to 1 percent
+        tol = 1e-2
+
+        mat_E = 70.e9  # Young's modulus [Pa]
+        mat_nu = 0.23  # Poisson's ratio []
+        n_pts_x = 101
+        n_pts_y = 101
+        plate_len_x = 0.2
+        plate_len_y = 0.2
+        plate_thick = 1e-3
+        press = 100.
+        dx = plate_len_x / float(n_pts_x)
+
+        plate = recolo.make_plate(mat_E, mat_nu, 0.0, plate_thick)
+
+        win_size = 8
+        bend_stiff = mat_E * (plate_thick ** 3.) / (12. * (1. - mat_nu ** 2.))  # flexural rigidity [N m]
+
+        deflection = deflection_due_to_sinus_load(press, plate_len_x, plate_len_y, bend_stiff)
+
+        fields = recolo.fieldStack_from_disp_func(deflection, n_pts_x, n_pts_y, plate_len_x, plate_len_y)
+        # The virtual fields are centered on the pixels, such that no shift is needed
+        virtual_fields = recolo.virtual_fields.Hermite16(win_size, dx, centered=True)
+
+        field = fields(0)
+
+        recon_press = recolo.solver_VFM.calc_pressure_thin_elastic_plate(field, plate, virtual_fields)
+        correct_press = pressure_sinusoidal(press, n_pts_x, n_pts_y)[4:-4, 4:-4]
+        error = rms_diff(recon_press, correct_press)
+        if error / press > tol:
+            self.fail("Reconstruction had a normalized RMS error of %f" % (error / press))
+        if np.max(np.abs(recon_press - correct_press)) / press > 2.5e-2:
+            self.fail("Reconstruction had a normalized max error of %f" % (
+                np.max(np.abs(recon_press - correct_press)) / press))
+
 
 
 
@@ -0,0 +1,36 @@
+from unittest import TestCase
+import numpy as np
+import recolo
+from recolo.tests.fields_testing import harmonic_deflection_fields, FieldAssertions
+
+
+class Test_DeflectionSolver(TestCase, FieldAssertions):
+    def setUp(self):
+        self.tol = 1e-8
+        self.pixel_size = 2.e-3
+        self.sampling_rate = 1.e4
+        self.plate = recolo.make_plate(210.e9, 0.3, 7800., 5.e-3)
+        self.deflection_fields = harmonic_deflection_fields(7, 40, 46)
+        self.virtual_fields = recolo.virtual_fields.Hermite16(8, self.pixel_size)
+
+    def reference_pressure(self, acceleration_fields=None):
+        field_stack = recolo.kinematic_fields_from_deflections(self.deflection_fields, self.pixel_size,
+                                                               sampling_rate=self.sampling_rate,
+                                                               acceleration_field=acceleration_fields)
+        return np.array([recolo.solver_VFM.calc_pressure_thin_elastic_plate(field, self.plate, self.virtual_fields)
+                         for field in field_stack])
+
+    def test_same_as_kinematic_fields(self):
+        press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_from_deflections(self.deflection_fields,
+                                                                                   self.plate, self.virtual_fields,
+                                                                                   self.pixel_size,
+                                                                                   self.sampling_rate,
+                                                                                   batch_size=3)
+        self.assert_same_pressure(press, self.reference_pressure())
+
+    def test_same_as_kinematic_fields_given_accelerations(self):
+        acceleration_fields = 1.e3 * np.flip(self.deflection_fields, axis=1)
+        press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_from_deflections(
+            self.deflection_fields, self.plate, self.virtual_fields, self.pixel_size, self.sampling_rate,
+            acceleration_fields=acceleration_fields)
+        self.assert_same_pressure(press, self.reference_pressure(acceleration_fields))
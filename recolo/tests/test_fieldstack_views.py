@@ -0,0 +1,154 @@
+from unittest import TestCase
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import recolo
+from recolo.tests.fields_testing import harmonic_deflection_fields, FieldAssertions
+
+
+class Test_FieldStackViews(TestCase, FieldAssertions):
+    def setUp(self):
+        self.tol = 1e-12
+        self.pixel_size = 2.e-3
+        deflection_fields = harmonic_deflection_fields(12, 30, 34)
+        self.field_stack = recolo.kinematic_fields_from_deflections(deflection_fields, self.pixel_size,
+                                                                    sampling_rate=1.e4)
+        self.lazy_field_stack = recolo.kinematic_fields_from_deflections(deflection_fields, self.pixel_size,
+                                                                         sampling_rate=1.e4, lazy=True)
+        self.keys = [np.s_[2:9], np.s_[2:9, 3:20, 5:30], np.s_[::3, 0:5, ::2], np.s_[-4:, 28:]]
+
+    def test_views_share_memory(self):
+        for key in self.keys:
+            view = self.field_stack[key]
+            self.assertIsInstance(view, recolo.FieldStack)
+            self.assertTrue(np.shares_memory(view(0).curv_xx, self.field_stack(slice(None)).curv_xx))
+
+    def test_same_fields_as_indexing(self):
+        all_fields = self.field_stack(slice(None))
+        for key in self.keys:
+            time_key = key[0] if isinstance(key, tuple) else key
+            for view in [self.field_stack[key], self.lazy_field_stack[key]]:
+                fields = view(slice(None))
+                self.assert_same_fields(fields[:-1], [field[key] for field in all_fields[:-1]])
+                np.testing.assert_allclose(fields.time, all_fields.time[time_key])
+
+        self.assert_same_fields(self.lazy_field_stack[5, 10:12, 10:14],
+                                [np.asarray(field)[10:12, 10:14] if np.ndim(field) == 2 else field for field in
+                                 self.field_stack(5)])
+
+    def test_pressure_in_region_of_interest(self):
+        plate = recolo.make_plate(210.e9, 0.3, 7800., 5.e-3)
+        virtual_fields = recolo.virtual_fields.Hermite16(8, self.pixel_size)
+        press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_stack(self.field_stack, plate, virtual_fields)
+        for field_stack in [self.field_stack, self.lazy_field_stack]:
+            roi_press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_stack(field_stack[3:10, 5:25, 4:20],
+                                                                                plate, virtual_fields)
+            self.assert_same_pressure(roi_press, press[3:10, 5:18, 4:13])
+
+    def test_invalid_keys(self):
+        with self.assertRaises(IndexError):
+            self.field_stack[::-1]
+        with self.assertRaises(IndexError):
+            self.field_stack[0, 1]
+        with self.assertRaises(IndexError):
+            self.lazy_field_stack[12]
+
+
+class Test_FieldStackPersistence(TestCase):
+    def setUp(self):
+        self.pixel_size = 2.e-3
+        self.deflection_fields = harmonic_deflection_fields(7, 20, 24)
+        self.field_stack = recolo.kinematic_fields_from_deflections(self.deflection_fields, self.pixel_size,
+                                                                    sampling_rate=1.e4)
+
+    def assert_equal_stacks(self, field_stack, correct_field_stack):
+        self.assertEqual(field_stack.shape(), correct_field_stack.shape())
+        for name, field, correct_field in zip(recolo.Fields._fields, field_stack(slice(None)),
+                                              correct_field_stack(slice(None))):
+            if not np.array_equal(field, correct_field):
+                self.fail("The %s fields differ" % name)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as path:
+            self.field_stack.save(path, batch_size=3)
+            loaded_stack = recolo.FieldStack.load(path)
+            self.assertIsInstance(loaded_stack(0).curv_xx, np.memmap)
+            self.assert_equal_stacks(loaded_stack, self.field_stack)
+            self.assert_equal_stacks(recolo.FieldStack.load(path, mmap=False), self.field_stack)
+            del loaded_stack
+
+    def test_save_lazy_stack(self):
+        lazy_stack = recolo.kinematic_fields_from_deflections(self.deflection_fields, self.pixel_size,
+                                                              sampling_rate=1.e4, lazy=True)
+        with tempfile.TemporaryDirectory() as path:
+            lazy_stack[1:6, 2:18, 3:20].save(path, batch_size=2)
+            self.assert_equal_stacks(recolo.FieldStack.load(path, mmap=False), self.field_stack[1:6, 2:18, 3:20])
+
+
+class Test_ContiguousFieldStack(TestCase):
+    def setUp(self):
+        self.pixel_size = 2.e-3
+        self.deflection_fields = harmonic_deflection_fields(9, 20, 24)
+        self.field_stack = recolo.kinematic_fields_from_deflections(self.deflection_fields, self.pixel_size,
+                                                                    sampling_rate=1.e4)
+
+    def test_same_fields_as_separate_arrays(self):
+        block_stack = recolo.fieldStack_from_disp_fields(self.deflection_fields, None, np.arange(9) * 1.e-4,
+                                                         20 * self.pixel_size, 24 * self.pixel_size,
+                                                         dtype=np.float64, batch_size=2)
+        block = block_stack.block()
+        self.assertEqual(block.shape, (7, 9, 20, 24))
+        self.assertTrue(block.flags.c_contiguous)
+        for fields, correct_fields in zip(block_stack, self.field_stack):
+            for name, field, correct_field in zip(recolo.Fields._fields, fields, correct_fields):
+                if name != "time":
+                    self.assertTrue(np.shares_memory(field, block))
+                if np.max(np.abs(field - correct_field)) > 1e-12 * np.max(np.abs(correct_field)):
+                    self.fail("The %s fields differ" % name)
+
+    def test_views_and_dtype(self):
+        block_stack = self.field_stack.contiguous(dtype=np.float32, batch_size=4)
+        self.assertEqual(block_stack.block().dtype, np.float32)
+        view = block_stack[2:5, 3:10]
+        self.assertTrue(np.shares_memory(view.block(), block_stack.block()))
+        np.testing.assert_allclose(view(1).curv_xx, self.field_stack(3).curv_xx[3:10], rtol=1e-6)
+
+        with self.assertRaises(ValueError):
+            recolo.FieldStack.from_block(np.zeros((6, 2, 3, 3)), np.arange(2))
+
+
+class Test_FieldStackIterators(TestCase):
+    def setUp(self):
+        self.field_stack = recolo.kinematic_fields_from_deflections(harmonic_deflection_fields(11, 12, 14), 2.e-3,
+                                                                    sampling_rate=1.e4)
+
+    def test_independent_iterators(self):
+        first_iterator = iter(self.field_stack)
+        next(first_iterator)
+        second_iterator = iter(self.field_stack)
+        self.assertEqual(next(second_iterator).time, self.field_stack(0).time)
+        self.assertEqual(next(first_iterator).time, self.field_stack(1).time)
+        self.assertEqual(len(list(self.field_stack)), 11)
+
+    def test_batches_cover_all_frames(self):
+        batches = self.field_stack.iter_batches(3)
+        self.assertEqual(len(batches), 4)
+        frames = [batch.frames for batch in batches]
+        self.assertEqual(frames, [slice(0, 3), slice(3, 6), slice(6, 9), slice(9, 11)])
+
+        frames, fields = next(iter(self.field_stack.iter_batches(4)))
+        self.assertTrue(np.shares_memory(fields.curv_xx, self.field_stack(slice(None)).curv_xx))
+        np.testing.assert_array_equal(fields.curv_xx, self.field_stack(slice(0, 4)).curv_xx)
+
+    def test_concurrent_consumers(self):
+        batches = self.field_stack.iter_batches(1)
+        consumed = []
+
+        def consume():
+            for frames, fields in batches:
+                consumed.append(frames.start)
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for future in [pool.submit(consume) for _ in range(4)]:
+                future.result()
+        self.assertEqual(sorted(consumed), list(range(11)))
@@ -1,5 +1,5 @@
 from unittest import TestCase
-from recolo import kinematic_fields_from_deflections
+from recolo import kinematic_fields_from_deflections, fieldStack_from_disp_fields
 import numpy as np
 
 
@@ -142,4 +142,70 @@ class TestHalfSineDeflection(TestCase):
             calculated_slope = field.slope_x
             peak_relative_error = np.max(np.abs(correct_slope-calculated_slope)/correct_slope_peak_amp)
             if peak_relative_error > self.curv_rel_tol:
-                self.fail("Relative error of %f was found for slope_y"%peak_relative_error)
\ No newline at end of file
+                self.fail("Relative error of %f was found for slope_y"%peak_relative_error)
+
+class TestGaussianDerivatives(TestCase):
+    def setUp(self):
+        self.rel_tol = 1e-2
+        self.sigma = 2.
+        n_pts_x = 120
+        n_pts_y = 100
+        time_ramp = 0.5 * np.arange(1, 12, 1) ** 2.
+        xs, ys = np.meshgrid(np.linspace(0, 1, n_pts_y), np.linspace(0, 1, n_pts_x))
+        deflection_field = np.sin(np.pi * xs) * np.sin(np.pi * ys)
+        self.deflection_fields = deflection_field[np.newaxis, :, :] * time_ramp[:, np.newaxis, np.newaxis]
+
+    def test_same_as_central_differences(self):
+        # A physical pixel size checks the scaling of the derivative kernels by the pixel size
+        for pixel_size in [1., 2.e-3]:
+            field_stack = kinematic_fields_from_deflections(self.deflection_fields, pixel_size, sampling_rate=1.,
+                                                            filter_space_sigma=self.sigma)
+            gaussian_field_stack = kinematic_fields_from_deflections(self.deflection_fields, pixel_size,
+                                                                     sampling_rate=1., filter_space_sigma=self.sigma,
+                                                                     spatial_differentiation="gaussian")
+            self.assertEqual(field_stack.shape(), gaussian_field_stack.shape())
+            for fields, gaussian_fields in zip(field_stack, gaussian_field_stack):
+                for name, field, gaussian_field in zip(fields._fields, fields, gaussian_fields):
+                    if name == "time":
+                        continue
+                    # The central differences are of first order at the two outermost pixels
+                    peak_relative_error = np.max(np.abs(field - gaussian_field)[2:-2, 2:-2]) / np.max(np.abs(field))
+                    if peak_relative_error > self.rel_tol:
+                        self.fail("Relative error of %f was found for %s with a pixel size of %f" % (
+                            peak_relative_error, name, pixel_size))
+
+    def test_requires_filter_sigma(self):
+        with self.assertRaises(ValueError):
+            kinematic_fields_from_deflections(self.deflection_fields, 1., sampling_rate=1.,
+                                              spatial_differentiation="gaussian")
+
+
+class TestAccelerationStencil(TestCase):
+    def test_same_as_double_gradient(self):
+        time_step_size = 1.e-4
+        for n_frames in [2, 3, 4, 5, 9]:
+            deflection_fields = np.random.default_rng(n_frames).standard_normal((n_frames, 6, 7))
+            field_stack = fieldStack_from_disp_fields(deflection_fields, None, np.arange(n_frames) * time_step_size,
+                                                      1., 1.)
+            correct_acceleration = np.gradient(np.gradient(deflection_fields, axis=0) / time_step_size,
+                                               axis=0) / time_step_size
+            error = np.max(np.abs(field_stack(slice(None)).acceleration - correct_acceleration))
+            if error > 1e-12 * np.max(np.abs(correct_acceleration)):
+                self.fail("The accelerations for %i frames differ from the double gradient" % n_frames)
+
+    def test_deflection_fields_are_copied(self):
+        deflection_fields = np.random.default_rng(0).standard_normal((5, 6, 7))
+        field_stack = fieldStack_from_disp_fields(deflection_fields, None, np.arange(5) * 1.e-4, 1., 1.)
+        deflection_fields[:] = 0.
+        if np.all(field_stack(2).deflection == 0.):
+            self.fail("The field stack shares the deflection fields of the caller")
+
+    def test_float_data_type_is_kept(self):
+        for dtype, correct_dtype in [(np.float32, np.float32), (np.float64, np.float64), (np.int64, np.float64)]:
+            deflection_fields = (np.random.default_rng(0).standard_normal((5, 6, 7)) * 10.).astype(dtype)
+            field_stack = fieldStack_from_disp_fields(deflection_fields, None, np.arange(5) * 1.e-4, 1., 1.)
+            fields = field_stack(2)
+            for field in [fields.deflection, fields.slope_x, fields.slope_y, fields.curv_xx, fields.curv_yy,
+                          fields.curv_xy, fields.acceleration]:
+                if field.dtype != correct_dtype:
+                    self.fail("The fields of %s deflections have the data type %s" % (np.dtype(dtype), field.dtype))
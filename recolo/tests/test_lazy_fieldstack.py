@@ -0,0 +1,58 @@
+from unittest import TestCase
+import numpy as np
+import recolo
+from recolo.tests.fields_testing import harmonic_deflection_fields, FieldAssertions
+
+
+class Test_LazyFieldStack(TestCase, FieldAssertions):
+    def setUp(self):
+        self.tol = 1e-12
+        self.pixel_size = 2.e-3
+        self.deflection_fields = harmonic_deflection_fields(9, 30, 34)
+        self.field_stack = recolo.kinematic_fields_from_deflections(self.deflection_fields, self.pixel_size,
+                                                                    sampling_rate=1.e4)
+
+    def test_same_as_eager(self):
+        for cache_size in [0, 3]:
+            lazy_stack = recolo.kinematic_fields_from_deflections(self.deflection_fields, self.pixel_size,
+                                                                  sampling_rate=1.e4, lazy=True,
+                                                                  cache_size=cache_size)
+            self.assertIsInstance(lazy_stack, recolo.LazyFieldStack)
+            self.assertEqual(lazy_stack.shape(), self.field_stack.shape())
+            for fields, correct_fields in zip(lazy_stack, self.field_stack):
+                self.assert_same_fields(fields, correct_fields)
+            self.assert_same_fields(lazy_stack(-1), self.field_stack(-1))
+            self.assert_same_fields(lazy_stack(slice(2, 7)), self.field_stack(slice(2, 7)))
+
+    def test_given_acceleration(self):
+        acceleration_fields = np.ones_like(self.deflection_fields)
+        lazy_stack = recolo.kinematic_fields_from_deflections(self.deflection_fields, self.pixel_size,
+                                                              sampling_rate=1.e4,
+                                                              acceleration_field=acceleration_fields, lazy=True)
+        self.assert_same_fields(lazy_stack(4).acceleration, acceleration_fields[4])
+
+    def test_bounded_cache(self):
+        lazy_stack = recolo.kinematic_fields_from_deflections(self.deflection_fields, self.pixel_size,
+                                                              sampling_rate=1.e4, lazy=True, cache_size=2)
+        first_fields = lazy_stack(0)
+        self.assertIs(lazy_stack(0), first_fields)
+        lazy_stack(1)
+        lazy_stack(2)
+        self.assertIsNot(lazy_stack(0), first_fields)
+
+    def test_same_pressure_as_eager(self):
+        plate = recolo.make_plate(210.e9, 0.3, 7800., 5.e-3)
+        virtual_fields = recolo.virtual_fields.Hermite16(8, self.pixel_size)
+        lazy_stack = recolo.kinematic_fields_from_deflections(self.deflection_fields, self.pixel_size,
+                                                              sampling_rate=1.e4, lazy=True)
+        press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_stack(lazy_stack, plate, virtual_fields,
+                                                                        batch_size=4)
+        correct_press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_stack(self.field_stack, plate,
+                                                                                virtual_fields)
+        self.assert_same_pressure(press, correct_press)
+
+    def test_frame_out_of_range(self):
+        lazy_stack = recolo.kinematic_fields_from_deflections(self.deflection_fields, self.pixel_size,
+                                                              sampling_rate=1.e4, lazy=True)
+        with self.assertRaises(IndexError):
+            lazy_stack(9)
@@ -0,0 +1,52 @@
+from unittest import TestCase
+import numpy as np
+import recolo
+from recolo.tests.fields_testing import harmonic_deflection_fields, FieldAssertions
+from multiprocessing import shared_memory
+from unittest import mock
+
+
+class Test_ParallelSolver(TestCase, FieldAssertions):
+    def setUp(self):
+        self.tol = 1e-8
+        self.pixel_size = 2.e-3
+        self.plate = recolo.make_plate(210.e9, 0.3, 7800., 5.e-3)
+        deflection_fields = harmonic_deflection_fields(11, 30, 34)
+        self.field_stack = recolo.kinematic_fields_from_deflections(deflection_fields, self.pixel_size,
+                                                                    sampling_rate=1.e4)
+        self.virtual_fields = recolo.virtual_fields.Hermite16(8, self.pixel_size)
+        self.press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_stack(self.field_stack, self.plate,
+                                                                             self.virtual_fields, shift=True)
+
+    def test_process_executor(self):
+        press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_parallel(self.field_stack, self.plate,
+                                                                           self.virtual_fields, shift=True,
+                                                                           n_workers=2, frames_per_task=3,
+                                                                           batch_size=2)
+        self.assert_same_pressure(press, self.press)
+
+    def test_thread_executor_into_preallocated_array(self):
+        out = np.zeros_like(self.press)
+        press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_parallel(self.field_stack, self.plate,
+                                                                           self.virtual_fields, shift=True,
+                                                                           n_workers=3, executor="thread",
+                                                                           method="separable", out=out)
+        if press is not out:
+            self.fail("The results were not written into the preallocated array")
+        self.assert_same_pressure(out, self.press)
+
+    def test_shared_memory_released_when_allocation_fails(self):
+        create_shared_array = recolo.solver_VFM.parallel._create_shared_array
+        created_blocks = []
+
+        def create_or_fail(shape, dtype):
+            if created_blocks:
+                raise OSError("No space left on device")
+            shm, array = create_shared_array(shape, dtype)
+            created_blocks.append(shm.name)
+            return shm, array
+
+        with mock.patch("recolo.solver_VFM.parallel._create_shared_array", create_or_fail):
+            self.assertRaises(OSError, recolo.solver_VFM.calc_pressure_thin_elastic_plate_parallel,
+                              self.field_stack, self.plate, self.virtual_fields, n_workers=1)
+        self.assertRaises(FileNotFoundError, shared_memory.SharedMemory, name=created_blocks[0])
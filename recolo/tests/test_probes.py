@@ -0,0 +1,50 @@
+from unittest import TestCase
+import numpy as np
+import recolo
+from recolo.tests.fields_testing import harmonic_deflection_fields, FieldAssertions
+
+
+class Test_Probes(TestCase, FieldAssertions):
+    def setUp(self):
+        self.tol = 1e-8
+        self.pixel_size = 2.e-3
+        self.plate = recolo.make_plate(210.e9, 0.3, 7800., 5.e-3)
+        deflection_fields = harmonic_deflection_fields(7, 40, 46)
+        self.field_stack = recolo.kinematic_fields_from_deflections(deflection_fields, self.pixel_size,
+                                                                    sampling_rate=1.e4)
+        self.virtual_fields = recolo.virtual_fields.Hermite16(8, self.pixel_size)
+        self.press = np.array(
+            [recolo.solver_VFM.calc_pressure_thin_elastic_plate(field, self.plate, self.virtual_fields) for field in
+             self.field_stack])
+
+    def test_points(self):
+        points = [(0, 0), (16, 19), (32, 38), (5, 30)]
+        press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_probes(self.field_stack, self.plate,
+                                                                         self.virtual_fields, points=points,
+                                                                         batch_size=3)
+        correct_press = np.array([self.press[:, row, col] for row, col in points]).transpose()
+        self.assert_same_pressure(press, correct_press)
+
+    def test_stride(self):
+        for stride in [1, 4, 5]:
+            press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_probes(self.field_stack, self.plate,
+                                                                             self.virtual_fields, stride=stride)
+            self.assert_same_pressure(press, self.press[:, ::stride, ::stride])
+
+    def test_points_outside_pressure_field(self):
+        with self.assertRaises(ValueError):
+            recolo.solver_VFM.calc_pressure_thin_elastic_plate_probes(self.field_stack, self.plate,
+                                                                     self.virtual_fields, points=[(33, 0)])
+
+    def test_force_in_regions(self):
+        mask = np.zeros(self.press.shape[1:], dtype=bool)
+        mask[3:20, 10:12] = True
+        mask[25, 30] = True
+        regions = [np.s_[:, :], np.s_[5:20, 7:31], mask]
+        force = recolo.solver_VFM.calc_force_thin_elastic_plate_regions(self.field_stack, self.plate,
+                                                                       self.virtual_fields, regions,
+                                                                       self.pixel_size, batch_size=3)
+        correct_force = np.array([np.sum(self.press[:, :, :], axis=(1, 2)),
+                                  np.sum(self.press[:, 5:20, 7:31], axis=(1, 2)),
+                                  np.sum(self.press[:, mask], axis=1)]).transpose() * self.pixel_size ** 2.
+        self.assert_same_pressure(force, correct_force)
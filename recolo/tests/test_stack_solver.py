@@ -0,0 +1,135 @@
+from unittest import TestCase
+import numpy as np
+import recolo
+from recolo.tests.fields_testing import harmonic_deflection_fields, FieldAssertions
+
+
+class Test_StackSolver(TestCase, FieldAssertions):
+    def setUp(self):
+        self.tol = 1e-8
+        self.pixel_size = 2.e-3
+        self.plate = recolo.make_plate(210.e9, 0.3, 7800., 5.e-3)
+        deflection_fields = harmonic_deflection_fields(7, 40, 46)
+        self.field_stack = recolo.kinematic_fields_from_deflections(deflection_fields, self.pixel_size,
+                                                                    sampling_rate=1.e4)
+        self.virtual_fields = recolo.virtual_fields.Hermite16(8, self.pixel_size)
+
+    def reference_pressure(self, shift=False, plate=None):
+        plate = self.plate if plate is None else plate
+        return np.array(
+            [recolo.solver_VFM.calc_pressure_thin_elastic_plate(field, plate, self.virtual_fields, shift=shift)
+             for field in self.field_stack])
+
+    def test_same_as_frame_by_frame(self):
+        press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_stack(self.field_stack, self.plate,
+                                                                        self.virtual_fields, batch_size=3)
+        self.assert_same_pressure(press, self.reference_pressure())
+
+    def test_same_as_frame_by_frame_shifted(self):
+        press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_stack(self.field_stack, self.plate,
+                                                                        self.virtual_fields, shift=True)
+        self.assert_same_pressure(press, self.reference_pressure(shift=True))
+
+    def test_separable_same_as_frame_by_frame(self):
+        press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_stack(self.field_stack, self.plate,
+                                                                        self.virtual_fields, batch_size=3,
+                                                                        method="separable")
+        self.assert_same_pressure(press, self.reference_pressure())
+
+    def test_basis_same_as_frame_by_frame(self):
+        for method in ["fft", "separable"]:
+            basis = recolo.solver_VFM.calc_pressure_basis_thin_elastic_plate_stack(self.field_stack,
+                                                                                  self.virtual_fields,
+                                                                                  batch_size=3, method=method)
+            self.assert_same_pressure(recolo.solver_VFM.pressure_from_basis(basis, self.plate),
+                                      self.reference_pressure())
+
+            # Any other plate is a linear combination of the same basis maps
+            other_plate = recolo.make_plate(70.e9, 0.23, 2700., 2.e-3)
+            self.assert_same_pressure(recolo.solver_VFM.pressure_from_basis(basis, other_plate, shift=True),
+                                      self.reference_pressure(shift=True, plate=other_plate))
+
+    def test_window_sweep_same_as_stack(self):
+        win_sizes = [4, 8, 12]
+        presses = recolo.solver_VFM.calc_pressure_thin_elastic_plate_window_sweep(self.field_stack, self.plate,
+                                                                                 win_sizes, self.pixel_size,
+                                                                                 batch_size=3)
+        for win_size, press in zip(win_sizes, presses):
+            virtual_fields = recolo.virtual_fields.Hermite16(win_size, self.pixel_size)
+            correct_press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_stack(self.field_stack, self.plate,
+                                                                                    virtual_fields)
+            self.assert_same_pressure(press, correct_press)
+
+    def test_centered_same_as_frame_by_frame(self):
+        virtual_fields = recolo.virtual_fields.Hermite16(8, self.pixel_size, centered=True)
+        correct_press = np.array(
+            [recolo.solver_VFM.calc_pressure_thin_elastic_plate(field, self.plate, virtual_fields)
+             for field in self.field_stack])
+        for method in ["fft", "separable"]:
+            press = recolo.solver_VFM.calc_pressure_thin_elastic_plate_stack(self.field_stack, self.plate,
+                                                                            virtual_fields, method=method)
+            self.assert_same_pressure(press, correct_press)
+
+        with self.assertRaises(ValueError):
+            recolo.solver_VFM.calc_pressure_thin_elastic_plate_stack(self.field_stack, self.plate, virtual_fields,
+                                                                    shift=True)
+
+    def test_invalid_batch_size(self):
+        with self.assertRaises(ValueError):
+            recolo.solver_VFM.calc_pressure_thin_elastic_plate_stack(self.field_stack, self.plate,
+                                                                    self.virtual_fields, batch_size=0)
+
+
+class Test_KernelBank(TestCase):
+    def test_kernels_are_reused(self):
+        virtual_fields = recolo.virtual_fields.Hermite16(10, 1.e-3)
+        same_virtual_fields = recolo.virtual_fields.Hermite16(10, 1.e-3)
+        if virtual_fields.curv_xx is not same_virtual_fields.curv_xx:
+            self.fail("The kernels were rebuilt for the same window size and pixel size")
+        if virtual_fields.spectra((32, 32))[0] is not same_virtual_fields.spectra((32, 32))[0]:
+            self.fail("The spectra were recalculated for the same transform shape")
+
+    def test_kernels_are_read_only(self):
+        virtual_fields = recolo.virtual_fields.Hermite16(10, 1.e-3)
+        with self.assertRaises(ValueError):
+            virtual_fields.deflection[0, 0] = 1.
+
+    def test_kernels_are_separable(self):
+        virtual_fields = recolo.virtual_fields.Hermite16(12, 1.e-3)
+        kernels = [virtual_fields.curv_xx, virtual_fields.curv_yy, virtual_fields.curv_xy, virtual_fields.deflection]
+        for kernel, (factor_x, factor_y) in zip(kernels, virtual_fields.factors):
+            if np.max(np.abs(np.outer(factor_x, factor_y) - kernel)) > 1e-12 * np.max(np.abs(kernel)):
+                self.fail("The virtual field is not the outer product of its factors")
+
+    def test_least_recently_used_are_evicted(self):
+        calls = []
+
+        def build_kernels(window_size, phys_pixel_size):
+            calls.append(window_size)
+            return [np.ones((window_size, window_size))]
+
+        kernel_bank = recolo.virtual_fields.KernelBank(build_kernels, max_kernels=2)
+        for window_size in [2, 4, 2, 6, 2, 4]:
+            kernel_bank.kernels(window_size, 1.)
+        self.assertEqual(calls, [2, 4, 6, 4])
+
+    def test_spectra_are_bounded_by_bytes(self):
+        def build_kernels(window_size, phys_pixel_size):
+            return [np.ones((window_size, window_size))]
+
+        spectrum_bytes = 32 * 17 * np.dtype(complex).itemsize
+        kernel_bank = recolo.virtual_fields.KernelBank(build_kernels, max_spectra_bytes=2 * spectrum_bytes)
+        for shape in [(32, 32), (32, 31), (32, 32), (32, 33)]:
+            kernel_bank.spectra(4, 1., shape)
+        if kernel_bank.spectra_bytes() > 2 * spectrum_bytes:
+            self.fail("The spectra exceed the byte limit of the kernel bank")
+        kernel_bank.resize(max_spectra_bytes=0)
+        if kernel_bank.spectra_bytes() != spectrum_bytes:
+            self.fail("The most recently used spectra were not kept in the kernel bank")
+
+    def test_shared_kernel_bank_is_cleared(self):
+        virtual_fields = recolo.virtual_fields.Hermite16(10, 1.e-3)
+        spectra = virtual_fields.spectra((32, 32))
+        recolo.virtual_fields.clear_kernel_bank()
+        if virtual_fields.spectra((32, 32))[0] is spectra[0]:
+            self.fail("The spectra were kept after clearing the kernel bank")
@@ -0,0 +1,70 @@
+from unittest import TestCase
+import numpy as np
+import recolo
+from recolo.tests.fields_testing import harmonic_deflection_fields, FieldAssertions
+
+
+class Test_StreamingFieldStack(TestCase, FieldAssertions):
+    def setUp(self):
+        self.tol = 1e-12
+        self.pixel_size = 2.e-3
+        self.sampling_rate = 1.e4
+
+    def stream(self, deflection_fields, **kwargs):
+        stream = recolo.StreamingFieldStack(self.pixel_size, self.sampling_rate, **kwargs)
+        emitted = []
+        for defl_field in deflection_fields:
+            emitted.append(stream.append(defl_field))
+        emitted.append(stream.close())
+        return emitted
+
+    def test_same_as_eager(self):
+        for n_frames in [2, 3, 4, 5, 12]:
+            deflection_fields = harmonic_deflection_fields(n_frames, 20, 22)
+            field_stack = recolo.kinematic_fields_from_deflections(deflection_fields, self.pixel_size,
+                                                                   self.sampling_rate)
+            streamed = [fields for emitted in self.stream(deflection_fields) for fields in emitted]
+            self.assertEqual(len(streamed), n_frames)
+            for fields, correct_fields in zip(streamed, field_stack):
+                self.assert_same_fields(fields, correct_fields)
+
+    def test_same_as_eager_filtered(self):
+        deflection_fields = harmonic_deflection_fields(8, 30, 32)
+        field_stack = recolo.kinematic_fields_from_deflections(deflection_fields, self.pixel_size,
+                                                               self.sampling_rate, filter_space_sigma=2)
+        streamed = [fields for emitted in self.stream(deflection_fields, filter_space_sigma=2) for fields in
+                    emitted]
+        for fields, correct_fields in zip(streamed, field_stack):
+            self.assert_same_fields(fields, correct_fields)
+
+    def test_frames_emitted_with_two_frames_delay(self):
+        emitted = self.stream(harmonic_deflection_fields(10, 12, 12))
+        self.assertEqual([len(fields) for fields in emitted], [0, 0, 0, 2, 1, 1, 1, 1, 1, 1, 2])
+        self.assertEqual(emitted[4][0].time, 2. / self.sampling_rate)
+
+    def test_bounded_buffer(self):
+        stream = recolo.StreamingFieldStack(self.pixel_size, self.sampling_rate)
+        for defl_field in harmonic_deflection_fields(20, 12, 12):
+            stream.append(defl_field)
+        self.assertEqual(len(stream), 20)
+        self.assertEqual(len(stream._buffer_), 5)
+
+    def test_invalid_input(self):
+        stream = recolo.StreamingFieldStack(self.pixel_size, self.sampling_rate)
+        self.assertRaises(ValueError, stream.append, np.zeros(12))
+        stream.append(np.zeros((12, 12)))
+        self.assertRaises(ValueError, stream.append, np.zeros((12, 13)))
+        self.assertRaises(ValueError, stream.close)
+        stream.append(np.zeros((12, 12)))
+        stream.close()
+        self.assertRaises(ValueError, stream.append, np.zeros((12, 12)))
+
+    def test_same_as_eager_causal_filter(self):
+        deflection_fields = harmonic_deflection_fields(10, 30, 32)
+        field_stack = recolo.kinematic_fields_from_deflections(deflection_fields, self.pixel_size,
+                                                               self.sampling_rate, filter_space_sigma=2,
+                                                               filter_time_sigma=1.5, temporal_filter="causal")
+        streamed = [fields for emitted in self.stream(deflection_fields, filter_space_sigma=2,
+                                                      filter_time_sigma=1.5) for fields in emitted]
+        for fields, correct_fields in zip(streamed, field_stack):
+            self.assert_same_fields(fields, correct_fields)
@@ -0,0 +1,78 @@
+from unittest import TestCase
+import numpy as np
+import recolo
+from recolo.math_tools.temporal_kernels import gaussian_temporal_kernels, savgol_temporal_kernels, \
+    temporal_derivatives, CausalTemporalFilter
+
+
+class Test_TemporalDerivatives(TestCase):
+    def setUp(self):
+        self.tol = 1e-8
+        self.time_step_size = 1.e-3
+        self.acceleration = 7.
+        times = np.arange(60) * self.time_step_size
+        self.velocity = (2. + self.acceleration * times)[:, np.newaxis, np.newaxis] * np.ones((1, 5, 6))
+        deflection = 3. + 2. * times + 0.5 * self.acceleration * times ** 2.
+        self.deflection_fields = deflection[:, np.newaxis, np.newaxis] * np.ones((1, 5, 6))
+
+    def test_quadratic_motion(self):
+        for kernels in [savgol_temporal_kernels(9, 3, self.time_step_size),
+                        gaussian_temporal_kernels(2., self.time_step_size)]:
+            deflection, velocity, acceleration = temporal_derivatives(self.deflection_fields, kernels)
+            # Skip the frames affected by the ends of the stack
+            if np.max(np.abs(velocity - self.velocity)[10:-10]) > self.tol * np.max(np.abs(self.velocity)):
+                self.fail("The velocity is wrong")
+            if np.max(np.abs(acceleration - self.acceleration)[10:-10]) > self.tol * self.acceleration:
+                self.fail("The acceleration is wrong")
+
+    def test_chunked_same_as_whole_stack(self):
+        fields = np.random.default_rng(0).standard_normal((41, 5, 6))
+        kernels = gaussian_temporal_kernels(3., self.time_step_size)
+        correct_results = temporal_derivatives(fields, kernels)
+        out = tuple(np.zeros_like(fields) for _ in kernels)
+        results = temporal_derivatives(fields, kernels, chunk_size=4, out=out)
+        for result, correct_result, result_out in zip(results, correct_results, out):
+            self.assertIs(result, result_out)
+            if not np.array_equal(result, correct_result):
+                self.fail("The chunked results differ from the results for the whole stack")
+
+    def test_kinematic_fields_gaussian_in_time(self):
+        field_stack = recolo.kinematic_fields_from_deflections(self.deflection_fields, 1., 1. / self.time_step_size,
+                                                               filter_time_sigma=2.,
+                                                               temporal_differentiation="gaussian")
+        acceleration = field_stack(slice(10, 50)).acceleration
+        if np.max(np.abs(acceleration - self.acceleration)) > self.tol * self.acceleration:
+            self.fail("The acceleration is wrong")
+
+        with self.assertRaises(ValueError):
+            recolo.kinematic_fields_from_deflections(self.deflection_fields, 1., 1. / self.time_step_size,
+                                                     temporal_differentiation="gaussian")
+
+
+class Test_CausalTemporalFilter(TestCase):
+    def test_impulse_response(self):
+        tol = 1e-10
+        sigma = 3.
+        impulse = np.zeros((300, 2, 3))
+        impulse[20] = 1.
+        causal_filter = CausalTemporalFilter(sigma)
+        response = causal_filter(impulse)[:, 0, 0]
+        lags = np.arange(len(impulse)) - 20.
+
+        self.assertTrue(np.all(response[:20] == 0.))
+        self.assertAlmostEqual(np.sum(response), 1., delta=tol)
+        self.assertAlmostEqual(np.sum(response * lags), causal_filter.delay, delta=tol)
+        self.assertAlmostEqual(np.sum(response * (lags - causal_filter.delay) ** 2.), sigma ** 2., delta=tol)
+
+    def test_chunked_same_as_whole_stack(self):
+        fields = np.random.default_rng(0).standard_normal((41, 5, 6))
+        correct_fields = CausalTemporalFilter(2.)(fields)
+        causal_filter = CausalTemporalFilter(2.)
+        for chunk_size in [1, 7]:
+            causal_filter.reset()
+            chunks = [causal_filter(fields[i:i + chunk_size]) for i in range(0, len(fields), chunk_size)]
+            np.testing.assert_allclose(np.concatenate(chunks), correct_fields, rtol=0., atol=1e-12)
+
+    def test_constant_fields_unchanged(self):
+        fields = 3. * np.ones((10, 4, 4))
+        np.testing.assert_allclose(CausalTemporalFilter(2.)(fields), fields, rtol=1e-14)
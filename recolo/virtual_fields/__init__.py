@@ -1 +1,2 @@
-from .hermite16 import *
\ No newline at end of file
+from .hermite16 import *
+from .kernel_bank import KernelBank
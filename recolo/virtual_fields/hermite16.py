@@ -1,8 +1,14 @@
 import numpy as np
+from collections import namedtuple
+from .kernel_bank import KernelBank
+
+__all__ = ["Hermite16", "Hermite16Factors", "clear_kernel_bank", "set_kernel_bank_size"]
+
+Hermite16Factors = namedtuple("Hermite16Factors", ["curv_xx", "curv_yy", "curv_xy", "deflection"])
 
 
 class Hermite16(object):
-    def __init__(self, window_size, phys_pixel_size):
+    def __init__(self, window_size, phys_pixel_size, centered=False):
         """
         Definition of square Hermite 16 elements for VFM - assuming constant pressure
         output: 4-element field
@@ -19,138 +25,130 @@ class Hermite16(object):
             The size of the virtual field in pixels
         phys_pixel_size : float
             The physical pixel size
+        centered : bool
+            Sample the virtual fields at a half-pixel offset, such that the window is centered on a pixel.
+            The kernels then have window_size + 1 points along each axis and the reconstructed pressure is
+            aligned with the pixels of the kinematic fields, making the spline interpolation of shift=True
+            redundant.
+        """
+
+        self.window_size = window_size
+        self.phys_pixel_size = phys_pixel_size
+        self.centered = centered
+        self.curv_xx, self.curv_yy, self.curv_xy, self.deflection = _kernel_bank.kernels(window_size,
+                                                                                         phys_pixel_size, centered)
+        # Every virtual field is the outer product of a factor along the x-axis and a factor along the y-axis
+        self.factors = _hermite_16_factors(window_size, phys_pixel_size, centered)
+
+    def spectra(self, shape):
         """
+        Get the real-to-complex spectra of the virtual fields zero-padded to the given transform shape.
+        The spectra are cached in a kernel bank shared by all Hermite16 objects, such that they are only calculated
+        once per process. The cached spectra are kept in memory until they are evicted, which by default happens
+        when they exceed 256 MB in total. The memory is released by clear_kernel_bank and the limit is changed by
+        set_kernel_bank_size.
+
+        Parameters
+        ----------
+        shape : tuple
+            The padded shape of the transform, see recolo.math_tools.fft_convolution.fft_shape
+
+        Returns
+        -------
+        spectra : tuple
+            The spectra of curv_xx, curv_yy, curv_xy and deflection
+        """
+        return _kernel_bank.spectra(self.window_size, self.phys_pixel_size, shape, self.centered)
+
+
+def _hermite_16_profiles(xsi_1, xsi_2):
+    # Shape functions and their first and second derivatives for the right node (3) of the first element at xsi_1
+    # and the left node (1) of the second element at xsi_2
+    shape_func = np.concatenate(
+        (1. / 4. * (1. + xsi_1) ** 2. * (2. - xsi_1), 1. / 4. * (1. - xsi_2) ** 2. * (2. + xsi_2)))
+    first_deriv = np.concatenate((3. / 4. * (1. - xsi_1 ** 2.), -3. / 4. * (1. - xsi_2 ** 2.)))
+    second_deriv = np.concatenate((-6. / 4. * xsi_1, 6. / 4. * xsi_2))
+    return shape_func, first_deriv, second_deriv
+
+
+def _hermite_16_factors(window_size, phys_pixel_size, centered=False):
+    """
+    The one-dimensional factors of the Hermite 16 virtual fields.
+
+    The virtual fields are defined on a patch of 2x2 elements, where the shape functions are products of
+    one-dimensional Hermite polynomials. Along each axis, the first element uses the polynomials associated
+    with its right node and the second element those associated with its left node, such that every virtual
+    field is a single outer product of two one-dimensional profiles.
+
+    By default, the profiles are sampled at the pixel centers within the window. If centered, the window spans
+    the window_size + 1 pixels between the pixel centers at its edges, and the profiles are integrated exactly
+    against the piecewise linear interpolation of the kinematic fields between the pixel centers.
+    """
+    if window_size % 2 != 0:
+        raise ValueError("The window size has to be an even number")
+
+    window_length = window_size * phys_pixel_size
+    elm_length = window_length / 2.
+
+    if centered:
+        # Gauss-Legendre points within every pixel interval, which are exact for the products of the
+        # profiles and the linear interpolation
+        points, point_weights = np.polynomial.legendre.leggauss(3)
+        points = (points + 1.) / 2.
+        point_weights = point_weights / 2.
+        # Isoparametric coordinates of the points within the intervals of the two elements
+        xsi = 4. / window_size * (np.arange(window_size // 2)[:, np.newaxis] + points) - 1.
+        profiles = _hermite_16_profiles(xsi, xsi)
+
+        # Distribute the integrals over the interval onto the pixels at either end of the interval
+        shape_func, first_deriv, second_deriv = [np.zeros(window_size + 1) for _ in range(3)]
+        for factor, profile in zip((shape_func, first_deriv, second_deriv), profiles):
+            factor[:-1] += np.sum(point_weights * (1. - points) * profile, axis=1)
+            factor[1:] += np.sum(point_weights * points * profile, axis=1)
+    else:
+        # Isoparametric coordinates of the pixels within an element
+        coords = np.linspace(0, window_length, window_size + 1)[:window_size // 2]
+        xsi = 2. / elm_length * (coords + elm_length / window_size) - 1.
+        shape_func, first_deriv, second_deriv = _hermite_16_profiles(xsi, xsi)
+
+    # Scaling from isoparametric to physical coordinates
+    jacobian = elm_length / 2.
+
+    return Hermite16Factors(curv_xx=(-second_deriv / jacobian ** 2., shape_func),
+                            curv_yy=(-shape_func / jacobian ** 2., second_deriv),
+                            curv_xy=(-first_deriv / jacobian ** 2., first_deriv),
+                            deflection=(shape_func, shape_func))
+
+
+def _hermite_16_kernels(window_size, phys_pixel_size, centered=False):
+    factors = _hermite_16_factors(window_size, phys_pixel_size, centered)
+    return tuple(np.outer(factor_x, factor_y) for factor_x, factor_y in factors)
+
+
+# The kernels are shared by all Hermite16 instances with the same window size, pixel size and sampling
+_kernel_bank = KernelBank(_hermite_16_kernels)
+
+
+def clear_kernel_bank():
+    """
+    Remove all cached virtual fields and spectra from the kernel bank shared by the Hermite16 objects, releasing
+    their memory.
+    """
+    _kernel_bank.clear()
+
+
+def set_kernel_bank_size(max_spectra_bytes=None, max_spectra=None, max_kernels=None):
+    """
+    Change the limits of the kernel bank shared by the Hermite16 objects. The limits which are not given are left
+    unchanged.
 
-        # TODO: Make the code below readable to humans
-        window_length = window_size * phys_pixel_size
-        self.curv_xx, self.curv_yy, self.curv_xy, self.deflection = self.__hermite_16__(window_size,
-                                                                                        window_length)
-
-    def __hermite_16__(self, iprw, iL):
-        ###
-        # parameter definition
-        mh = 2
-        nh = 2  # Number of elements in each direction
-        # local coordinate mesh
-        Lx_el = iL / float(mh)
-        Ly_el = iL / float(nh)
-
-        x = np.linspace(0, iL, iprw + 1)
-        y = np.linspace(0, iL, iprw + 1)
-        aux_x, aux_y = np.meshgrid(x, y)
-
-        X1 = aux_x[0:iprw, 0:iprw]
-        X2 = aux_y[0:iprw, 0:iprw]
-
-        X1 = np.reshape(X1, (iprw ** 2))
-        X2 = np.reshape(X2, (iprw ** 2))
-
-        ###
-        # parametric coordinates
-        ###
-        i_1 = np.zeros(iprw * iprw)
-        aux_i_2 = np.zeros(iprw)
-        i_1[0:int(np.floor(iprw * iprw / 2))] = \
-            np.ones(int(np.floor(iprw * iprw / 2)))
-
-        i_1[int(np.floor(iprw * iprw / 2)):iprw * iprw] = \
-            2 * np.ones(iprw * iprw - int(np.floor(iprw * iprw / 2)))
-
-        aux_i_2[0:int(np.floor(iprw / 2))] = \
-            np.ones(int(np.floor(iprw / 2)))
-
-        aux_i_2[int(np.floor(iprw / 2)):iprw] = \
-            2 * np.ones(iprw - int(np.floor(iprw / 2)))
-        i_2 = aux_i_2
-        for i in range(1, int(np.floor(iprw))):
-            i_2 = np.concatenate((i_2, aux_i_2))
-
-        xsi1 = np.multiply(2 / Lx_el, (X1 - np.min(X1) + Lx_el / iprw)) \
-               - np.multiply(2, i_1) + 1
-
-        xsi2 = np.multiply(2 / Ly_el, (X2 - np.min(X2) + Ly_el / iprw)) \
-               - np.multiply(2, i_2) + 1
-
-        ## isoparametric formulation for hermite 16 elements
-        a = Lx_el / 2
-        b = Ly_el / 2
-        # shape function
-        Np1 = 1 / 4 * (1 - xsi1) ** 2 * (2 + xsi1)
-        Nq1 = 1 / 4 * (1 - xsi2) ** 2 * (2 + xsi2)
-        Np3 = 1 / 4 * (1 + xsi1) ** 2 * (2 - xsi1)
-        Nq3 = 1 / 4 * (1 + xsi2) ** 2 * (2 - xsi2)
-        # 1st derivative of shape function
-        Bp1 = 1 / 4 * (-3) * (1 - xsi1 ** 2)
-        Bq1 = 1 / 4 * (-3) * (1 - xsi2 ** 2)
-        Bp3 = 1 / 4 * (+3) * (1 - xsi1 ** 2)
-        Bq3 = 1 / 4 * (+3) * (1 - xsi2 ** 2)
-        # 2nd derivative of shape function
-        Cp1 = 1 / 4 * (6 * xsi1)
-        Cq1 = 1 / 4 * (6 * xsi2)
-        Cp3 = 1 / 4 * (-6 * xsi1)
-        Cq3 = 1 / 4 * (-6 * xsi2)
-        # virtual displacement
-        # w = np.ones((4, iprw**2))
-        w = np.array([Np1 * Nq1, Np3 * Nq1, Np3 * Nq3, Np1 * Nq3])
-        # virtual curvature
-        kxx = np.multiply(-1 / a ** 2, [Cp1 * Nq1, Cp3 * Nq1, Cp3 * Nq3, Cp1 * Nq3])
-        kyy = np.multiply(-1 / b ** 2, [Np1 * Cq1, Np3 * Cq1, Np3 * Cq3, Np1 * Cq3])
-        kxy = np.multiply(-1 / a / b, [Bp1 * Bq1, Bp3 * Bq1, Bp3 * Bq3, Bp1 * Bq3])
-        #
-        owfield = np.ones((iprw, iprw))
-        wfield1 = np.reshape(w[0, :], (iprw, iprw), order='F')
-        wfield2 = np.reshape(w[3, :], (iprw, iprw), order='F')
-        wfield3 = np.reshape(w[2, :], (iprw, iprw), order='F')
-        wfield4 = np.reshape(w[1, :], (iprw, iprw), order='F')
-        owfield[0:int(iprw / 2), 0:int(iprw / 2)] = \
-            wfield3[0:int(iprw / 2), 0:int(iprw / 2)]
-        owfield[int(iprw / 2):iprw, 0:int(iprw / 2)] = \
-            wfield2[0:int(iprw / 2), 0:int(iprw / 2)]
-        owfield[0:int(iprw / 2), int(iprw / 2):iprw] = \
-            wfield4[0:int(iprw / 2), 0:int(iprw / 2)]
-        owfield[int(iprw / 2):iprw, int(iprw / 2):iprw] = \
-            wfield1[0:int(iprw / 2), 0:int(iprw / 2)]
-        #
-        okxxfield = np.ones((iprw, iprw))
-        kxxfield1 = np.reshape(kxx[0, :], (iprw, iprw), order='F')
-        kxxfield2 = np.reshape(kxx[3, :], (iprw, iprw), order='F')
-        kxxfield3 = np.reshape(kxx[2, :], (iprw, iprw), order='F')
-        kxxfield4 = np.reshape(kxx[1, :], (iprw, iprw), order='F')
-        okxxfield[0:int(iprw / 2), 0:int(iprw / 2)] = \
-            kxxfield3[0:int(iprw / 2), 0:int(iprw / 2)]
-        okxxfield[int(iprw / 2):iprw, 0:int(iprw / 2)] = \
-            kxxfield2[0:int(iprw / 2), 0:int(iprw / 2)]
-        okxxfield[0:int(iprw / 2), int(iprw / 2):iprw] = \
-            kxxfield4[0:int(iprw / 2), 0:int(iprw / 2)]
-        okxxfield[int(iprw / 2):iprw, int(iprw / 2):iprw] = \
-            kxxfield1[0:int(iprw / 2), 0:int(iprw / 2)]
-        #
-        okyyfield = np.ones((iprw, iprw))
-        kyyfield1 = np.reshape(kyy[0, :], (iprw, iprw), order='F')
-        kyyfield2 = np.reshape(kyy[3, :], (iprw, iprw), order='F')
-        kyyfield3 = np.reshape(kyy[2, :], (iprw, iprw), order='F')
-        kyyfield4 = np.reshape(kyy[1, :], (iprw, iprw), order='F')
-        okyyfield[0:int(iprw / 2), 0:int(iprw / 2)] = \
-            kyyfield3[0:int(iprw / 2), 0:int(iprw / 2)]
-        okyyfield[int(iprw / 2):iprw, 0:int(iprw / 2)] = \
-            kyyfield2[0:int(iprw / 2), 0:int(iprw / 2)]
-        okyyfield[0:int(iprw / 2), int(iprw / 2):iprw] = \
-            kyyfield4[0:int(iprw / 2), 0:int(iprw / 2)]
-        okyyfield[int(iprw / 2):iprw, int(iprw / 2):iprw] = \
-            kyyfield1[0:int(iprw / 2), 0:int(iprw / 2)]
-        #
-        okxyfield = np.ones((iprw, iprw))
-        kxyfield1 = np.reshape(kxy[0, :], (iprw, iprw))
-        kxyfield2 = np.reshape(kxy[3, :], (iprw, iprw))
-        kxyfield3 = np.reshape(kxy[2, :], (iprw, iprw))
-        kxyfield4 = np.reshape(kxy[1, :], (iprw, iprw))
-        okxyfield[0:int(iprw / 2), 0:int(iprw / 2)] = \
-            kxyfield3[0:int(iprw / 2), 0:int(iprw / 2)]
-        okxyfield[int(iprw / 2):iprw, 0:int(iprw / 2)] = \
-            kxyfield2[0:int(iprw / 2), 0:int(iprw / 2)]
-        okxyfield[0:int(iprw / 2), int(iprw / 2):iprw] = \
-            kxyfield4[0:int(iprw / 2), 0:int(iprw / 2)]
-        okxyfield[int(iprw / 2):iprw, int(iprw / 2):iprw] = \
-            kxyfield1[0:int(iprw / 2), 0:int(iprw / 2)]
-        ###
-        return okxxfield, okyyfield, okxyfield, owfield
+    Parameters
+    ----------
+    max_spectra_bytes : int
+        The maximum total size in bytes of the cached spectra
+    max_spectra : int
+        The maximum number of cached sets of spectra
+    max_kernels : int
+        The maximum number of cached sets of virtual fields
+    """
+    _kernel_bank.resize(max_kernels, max_spectra, max_spectra_bytes)
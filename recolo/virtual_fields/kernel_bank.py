@@ -0,0 +1,156 @@
+import threading
+from collections import OrderedDict
+from recolo.math_tools.fft_convolution import rfft_fields
+
+
+def _read_only(arrays):
+    for array in arrays:
+        array.setflags(write=False)
+    return tuple(arrays)
+
+
+def _n_bytes(cache):
+    return sum(array.nbytes for arrays in cache.values() for array in arrays)
+
+
+class KernelBank(object):
+    def __init__(self, build_kernels, max_kernels=32, max_spectra=8, max_spectra_bytes=256 * 2 ** 20):
+        """
+        Memoized bank of virtual field kernels and their spectra.
+        The kernels are stored for every combination of window size, pixel size and options, and their spectra are stored
+        for every padded transform shape. The least recently used entries are evicted when the bank is full.
+        As the spectra of large fields are large, the spectra are also limited by their total size in bytes. The most
+        recently used set of spectra is always kept, even if it alone exceeds this limit.
+
+        The cached arrays are shared between all users of the bank and are therefore read-only.
+
+        Parameters
+        ----------
+        build_kernels : func
+            Function on the form kernels = func(window_size, phys_pixel_size, *options) returning a tuple of kernels
+        max_kernels : int
+            The maximum number of kernel sets which are kept in the bank
+        max_spectra : int
+            The maximum number of spectrum sets which are kept in the bank
+        max_spectra_bytes : int
+            The maximum total size in bytes of the spectra which are kept in the bank
+        """
+        self._build_kernels_ = build_kernels
+        self._max_kernels_ = max_kernels
+        self._max_spectra_ = max_spectra
+        self._max_spectra_bytes_ = max_spectra_bytes
+        self._kernels_ = OrderedDict()
+        self._spectra_ = OrderedDict()
+        self._lock_ = threading.Lock()
+
+    @staticmethod
+    def _lookup(cache, key, max_size, build, max_bytes=None):
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        value = build()
+        cache[key] = value
+        KernelBank._evict(cache, max_size, max_bytes)
+        return value
+
+    @staticmethod
+    def _evict(cache, max_size, max_bytes=None):
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+        if max_bytes is not None:
+            while len(cache) > 1 and _n_bytes(cache) > max_bytes:
+                cache.popitem(last=False)
+
+    def kernels(self, window_size, phys_pixel_size, *options):
+        """
+        Get the kernels for a given window size and pixel size.
+
+        Parameters
+        ----------
+        window_size : int
+            The size of the virtual field in pixels
+        phys_pixel_size : float
+            The physical pixel size
+        options
+            Additional hashable arguments passed on to build_kernels
+
+        Returns
+        -------
+        kernels : tuple
+            The kernels
+        """
+        key = (int(window_size), float(phys_pixel_size)) + options
+        with self._lock_:
+            return self._lookup(self._kernels_, key, self._max_kernels_,
+                                lambda: _read_only(self._build_kernels_(*key)))
+
+    def spectra(self, window_size, phys_pixel_size, shape, *options):
+        """
+        Get the real-to-complex spectra of the kernels for a given window size and pixel size, zero-padded to the
+        given transform shape.
+
+        Parameters
+        ----------
+        window_size : int
+            The size of the virtual field in pixels
+        phys_pixel_size : float
+            The physical pixel size
+        shape : tuple
+            The padded shape of the transform, see recolo.math_tools.fft_convolution.fft_shape
+        options
+            Additional hashable arguments passed on to build_kernels
+
+        Returns
+        -------
+        spectra : tuple
+            The spectra of the kernels
+        """
+        kernels = self.kernels(window_size, phys_pixel_size, *options)
+        shape = tuple(int(n) for n in shape)
+        key = (int(window_size), float(phys_pixel_size), shape) + options
+        with self._lock_:
+            return self._lookup(self._spectra_, key, self._max_spectra_,
+                                lambda: _read_only([rfft_fields(kernel, shape) for kernel in kernels]),
+                                self._max_spectra_bytes_)
+
+    def resize(self, max_kernels=None, max_spectra=None, max_spectra_bytes=None):
+        """
+        Change the limits of the bank, evicting the least recently used entries which no longer fit.
+        The limits which are not given are left unchanged.
+
+        Parameters
+        ----------
+        max_kernels : int
+            The maximum number of kernel sets which are kept in the bank
+        max_spectra : int
+            The maximum number of spectrum sets which are kept in the bank
+        max_spectra_bytes : int
+            The maximum total size in bytes of the spectra which are kept in the bank
+        """
+        with self._lock_:
+            if max_kernels is not None:
+                self._max_kernels_ = max_kernels
+            if max_spectra is not None:
+                self._max_spectra_ = max_spectra
+            if max_spectra_bytes is not None:
+                self._max_spectra_bytes_ = max_spectra_bytes
+            self._evict(self._kernels_, self._max_kernels_)
+            self._evict(self._spectra_, self._max_spectra_, self._max_spectra_bytes_)
+
+    def spectra_bytes(self):
+        """
+        The total size in bytes of the spectra kept in the bank.
+        """
+        with self._lock_:
+            return _n_bytes(self._spectra_)
+
+    def clear(self):
+        """
+        Remove all kernels and spectra from the bank.
+        """
+        with self._lock_:
+            self._kernels_.clear()
+            self._spectra_.clear()
+
+    def __len__(self):
+        return len(self._kernels_) + len(self._spectra_)